@@ -1,5 +1,6 @@
 #!/bin/bash
 
+# Same sweep in one Python process, keeping models loaded: python sweep.py --sweep_stages bert_embedding --bert_embedding_format binary
 years=(2015 2016)
 
 # List of DA types
@@ -12,7 +13,14 @@ ASPECT_RANDOM=("BERT-aspect" "CBERT-aspect" "BERT_prepend-aspect" "BERT_expand-a
 # Concatenate all DA types together
 all_da_types=("${BERT_da_types[@]}" "${CBERT_da_types[@]}" "${BERTexpand_da_types[@]}")
 
-base_command="python TorchBert.py"
+# Sharded, resumable extraction: the sentences are split in $shards shards embedded by $workers processes, and a rerun
+# after a crash only embeds the missing shards. Sentences already embedded for another DA type are taken from the cache.
+shards=4
+workers=2
+cache_file="data/programGeneratedData/temp/bert/embedding_cache.sqlite"
+# The embeddings are written as the .npy/.vocab files the model loads (utils.load_w2v_binary), so it does not have to
+# convert a text file first. Use --bert_embedding_format text for the text file of the original pipeline.
+base_command="python TorchBert.py --bert_shards $shards --bert_workers $workers --bert_cache_file $cache_file --bert_embedding_format binary"
 
 # Loop through each year and each DA type to run the command
 for year in "${years[@]}"
@@ -1,23 +1,38 @@
 from transformers import BertTokenizer, AutoTokenizer
 from transformers import pipeline
 import re
-import spacy
 import string
 import random as rd
 from tqdm import tqdm
 import Levenshtein
+import model_registry
+from mask_batching import MaskBatch, mask_batched, resolve, fill_mask_ids, augment_lines
 
 # Load the spaCy English model
-nlp = spacy.load('en_core_web_sm')
+nlp = model_registry.nlp
+parse = model_registry.parse_cache()
 ################################################################
 # Initialize BERT model
 ################################################################
 BERT_MODEL = 'bert-base-uncased'
-unmasker = pipeline(task='fill-mask', model="data/programGeneratedData/finetuning_data/_finetune_model/BERT/bert",
+
+def load_unmasker():
+    return pipeline(task='fill-mask', model="data/programGeneratedData/finetuning_data/_finetune_model/BERT/bert",
                      tokenizer='bert-base-uncased', top_k = 2)
-tokenizer = BertTokenizer.from_pretrained(BERT_MODEL)
 
-def file_maker(in_file, out_file, strategy):
+# loaded on first use, shared by all strategies
+unmasker = model_registry.lazy('BERT', load_unmasker)
+tokenizer = model_registry.lazy(BERT_MODEL + '_tokenizer', lambda: BertTokenizer.from_pretrained(BERT_MODEL))
+
+def unmasker_batch(texts, contexts=None):
+    """Fills the [MASK] of every text with the two most likely words of the fill-mask model, in batched forward passes"""
+    # the fill-mask pipeline did not truncate, so only cut texts at the model maximum
+    predictions = fill_mask_ids(unmasker.model, unmasker.tokenizer, texts, sample=False,
+                                max_length=unmasker.tokenizer.model_max_length)
+    return [[tokenizer.decode([token_id]) for token_id in pred] for pred in predictions]
+
+def file_maker(in_file, out_file, strategy, chunk_size=64, parse_cache_file=None, parse_processes=1):
+    global parse
     
     if strategy == "adverbs":
         augment_func = augment_sentence_adjective_adverbs
@@ -38,23 +53,29 @@ def file_maker(in_file, out_file, strategy):
     print(f'Starting BERT-augmentation {strategy=}')
     with open(in_file, 'r') as in_f, open(out_file, 'w+', encoding='utf-8') as out_f:
         lines = in_f.readlines()
-        for i in tqdm(range(0, len(lines) - 1, 3), desc="BERT-augmentation", unit="sentence"):
-            old_sentence = lines[i].strip()
-            target = lines[i + 1].strip()
-            sentiment = lines[i + 2].strip()
-            out_f.writelines([old_sentence + '\n', target + '\n', sentiment + '\n'])
-            new_sentence, target = augment_func(old_sentence, target)
-            out_f.writelines([new_sentence + '\n', target + '\n', sentiment + '\n'])
+        if strategy not in ["random", "aspect"]: # these strategies do not use spaCy
+            parse = model_registry.parse_cache(parse_cache_file, parse_processes)
+            sentences = [lines[i].strip() for i in range(0, len(lines) - 1, 3)]
+            targets = [lines[i + 1].strip() for i in range(0, len(lines) - 1, 3)]
+            parse.prime(targets + [re.sub(r'\$T\$', target, sentence) for sentence, target in zip(sentences, targets)])
+        with tqdm(total=(len(lines) + 1) // 3, desc="BERT-augmentation", unit="sentence") as progress:
+            for old_sentence, old_target, sentiment, new_sentence, target in augment_lines(lines, augment_func.steps, chunk_size, with_sentiment=False):
+                out_f.writelines([old_sentence + '\n', old_target + '\n', sentiment + '\n'])
+                out_f.writelines([new_sentence + '\n', target + '\n', sentiment + '\n'])
+                progress.update(1)
+    parse.save()
     return out_file
 
 def is_similar_enough(str1, str2, threshold=0.95):
     ratio = Levenshtein.ratio(str1, str2)
     return ratio >= threshold
 
+@mask_batched
 def augment_random(in_sentence, in_target):
     """
     This code is adapted from https://github.com/S127-Pi/HAABSA_PLUS_PLUS_DA/blob/master/bertAugmentation.py
     """
+    masks = MaskBatch(unmasker_batch)
 
     words = tokenizer.tokenize(in_sentence)
     tar = re.findall(r'\w+|[^\s\w]+', in_target)
@@ -114,19 +135,9 @@ def augment_random(in_sentence, in_target):
                         cur_sent[i] = '[MASK]'
                     else:
                         cur_sent[i-(3-tar_length)] = '[MASK]'
-                    results = unmasker(' '.join(cur_sent))
-                    predicted_words = []
-
-                    for result in results:
-                        token_id = result['token']
-                        token_str = tokenizer.decode([token_id])
-                        predicted_words.append(token_str)
-                    if predicted_words[0]==masked_word:
-                        augmented_sentence.append(predicted_words[1])
-                        i += 1
-                    else:
-                        augmented_sentence.append(predicted_words[0])
-                        i += 1
+                    slot = masks.add(' '.join(cur_sent), masked_word)
+                    augmented_sentence.append(slot)
+                    i += 1
                 elif 0.8 < prob2 <= 0.9:
                     amount_masked += 1
                     random_token = rd.choice(list(vocab.keys()))
@@ -139,45 +150,43 @@ def augment_random(in_sentence, in_target):
                 augmented_sentence.append(words[i])
                 i+=1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
     augmented_sentence_str = ' '.join(augmented_sentence)
 
     return augmented_sentence_str, in_target
 
+@mask_batched
 def augment_sentence_aspect(in_sentence, in_target):
     """
     This function selective substitute all aspects occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch)
     masked_word = in_target
     sentence_mask_target = re.sub(r'\$T\$', "[MASK]", in_sentence, count=1) # mask only the first occurence
     sentence_mask_target = re.sub(r'\$T\$', in_target, sentence_mask_target)
     
-    results = unmasker(sentence_mask_target)
-    predicted_words = []
-    target = ""
-    for result in results: # decode predicted tokens
-        token_id = result['token']
-        token_str = tokenizer.decode([token_id])
-        predicted_words.append(token_str)
-    if predicted_words[0] == masked_word: # skip to the next predicted word
-        target = predicted_words[1]
-    else:
-        target = predicted_words[0]
+    target = masks.add(sentence_mask_target, masked_word)
+    yield masks
+    target = resolve(target)
 
     return in_sentence, target
 
 
 
 
+@mask_batched
 def augment_sentence_nouns(in_sentence, in_target):
     """
     This function selective substitute all nouns occuring in a sentence
     """
-    tar = nlp(in_target)
+    masks = MaskBatch(unmasker_batch)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # replace $t$ with actual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     # tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
 
@@ -229,19 +238,9 @@ def augment_sentence_nouns(in_sentence, in_target):
                 cur_sent = doc_tokens.copy()
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
-                results = unmasker(' '.join(cur_sent))
-                predicted_words = []
-                for result in results: # decode predicted tokens
-                    token_id = result['token']
-                    token_str = tokenizer.decode([token_id])
-                    predicted_words.append(token_str)
-                # print(f"{predicted_words=}")
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -253,6 +252,9 @@ def augment_sentence_nouns(in_sentence, in_target):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
@@ -278,17 +280,19 @@ def augment_sentence_nouns(in_sentence, in_target):
 
     
 
+@mask_batched
 def augment_sentence_adjective_adverbs(in_sentence, in_target):
     """
     This function selective substitute 15% of adverbs or adjectives occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch)
 
-    tar = nlp(in_target)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # substitute $t$ with autual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     #tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
 
@@ -352,19 +356,9 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target):
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
                 amount_masked += 1
-                results = unmasker(' '.join(cur_sent))
-                predicted_words = []
-                for result in results: # decode predicted tokens
-                    token_id = result['token']
-                    token_str = tokenizer.decode([token_id])
-                    predicted_words.append(token_str)
-                # print(f"{predicted_words=}")
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -376,6 +370,9 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
@@ -396,17 +393,19 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target):
         raise ValueError
     return augmented_sentence_str, modified_target_str
 
+@mask_batched
 def augment_aspect_adj_adv(in_sentence, in_target):
     """
     This function selective substitute all aspect, adjectives and adverbs (15%) occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch)
 
-    tar = nlp(in_target)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # substitute $t$ with autual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
 
@@ -477,23 +476,11 @@ def augment_aspect_adj_adv(in_sentence, in_target):
                     cur_sent[i] = '[MASK]'
                     i += 1
                 amount_masked += 1
-                results = unmasker(' '.join(cur_sent))
-                predicted_words = []
-                for result in results: # decode predicted tokens
-                    token_id = result['token']
-                    token_str = tokenizer.decode([token_id])
-                    predicted_words.append(token_str)
-                # print(f"{predicted_words=}")
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    if target:
-                        modified_target = augmented_sentence[-1]
-                        target = False
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    if target:
-                        modified_target = augmented_sentence[-1]
-                        target = False
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                if target:
+                    modified_target = augmented_sentence[-1]
+                    target = False
             elif i in non_cand_idx:
                 augmented_sentence.append(modified_target)
                 curr_idx = len(augmented_sentence) - 1
@@ -503,6 +490,10 @@ def augment_aspect_adj_adv(in_sentence, in_target):
                 augmented_sentence.append(doc_tokens[i])                
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+    modified_target = resolve(modified_target)
+
     start = tar_idx[0]
     end = tar_idx[-1]+1
     augmented_sentence [start:end] = ["$T$"]
@@ -519,17 +510,19 @@ def augment_aspect_adj_adv(in_sentence, in_target):
     return augmented_sentence_str, modified_target
 
 
+@mask_batched
 def augment_all_noun_adj_adv(in_sentence, in_target):
     """
     This function selective substitute all nouns, adjectives and adverbs (15%) occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch)
 
-    tar = nlp(in_target)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # replace $t$ with actual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     # tar_idx = [i for i, token in enumerate(doc_tokens) if token in tar] # obtain target indices 
     # tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
@@ -595,18 +588,9 @@ def augment_all_noun_adj_adv(in_sentence, in_target):
                 cur_sent = doc_tokens.copy()
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
-                results = unmasker(' '.join(cur_sent))
-                predicted_words = []
-                for result in results: # decode predicted tokens
-                    token_id = result['token']
-                    token_str = tokenizer.decode([token_id])
-                    predicted_words.append(token_str)
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -618,6 +602,9 @@ def augment_all_noun_adj_adv(in_sentence, in_target):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
@@ -2,28 +2,37 @@ from transformers import BertTokenizer, BertForMaskedLM, AutoTokenizer
 import torch
 from transformers import pipeline
 import re
-import spacy
 import string
 import random as rd
 import torch.nn.functional as F
 from tqdm import tqdm
 import Levenshtein
+import model_registry
+from mask_batching import MaskBatch, mask_batched, resolve, fill_mask_ids, augment_lines
 
 # Load the spaCy English model
-nlp = spacy.load('en_core_web_sm')
+nlp = model_registry.nlp
+parse = model_registry.parse_cache()
 
 ################################################################
 # Initialize Finetuned CBERT model
 ################################################################
 BERT_MODEL = 'bert-base-uncased'
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = BertForMaskedLM.from_pretrained(BERT_MODEL,
-                                            cache_dir="transformers_cache")
-tokenizer = AutoTokenizer.from_pretrained("data/programGeneratedData/finetuning_data/_finetune_model/BERTP/tokenizer")
-model.load_state_dict(torch.load("data/programGeneratedData/finetuning_data/_finetune_model/BERTP/best_cmodbertp.pt", 
-                                 map_location=torch.device('cpu'))) # finetuned BERTprepend
 
-def file_maker(in_file, out_file, strategy):
+def load_model():
+    model = BertForMaskedLM.from_pretrained(BERT_MODEL,
+                                                cache_dir="transformers_cache")
+    model.load_state_dict(torch.load("data/programGeneratedData/finetuning_data/_finetune_model/BERTP/best_cmodbertp.pt", 
+                                     map_location=torch.device('cpu'))) # finetuned BERTprepend
+    return model
+
+# loaded on first use, shared by all strategies
+model = model_registry.lazy('BERTprepend', load_model)
+tokenizer = model_registry.lazy('BERTprepend_tokenizer', lambda: AutoTokenizer.from_pretrained("data/programGeneratedData/finetuning_data/_finetune_model/BERTP/tokenizer"))
+
+def file_maker(in_file, out_file, strategy, chunk_size=64, parse_cache_file=None, parse_processes=1):
+    global parse
 
     if strategy == "adverbs":
         augment_func = augment_sentence_adjective_adverbs
@@ -44,57 +53,48 @@ def file_maker(in_file, out_file, strategy):
     print(f'Starting BERTprepend-augmentation {strategy=}')
     with open(in_file, 'r') as in_f, open(out_file, 'w+', encoding='utf-8') as out_f:
         lines = in_f.readlines()
-        for i in tqdm(range(0, len(lines) - 1, 3), desc="BERTprepend-augmentation", unit="sentence"):
-            old_sentence = lines[i].strip()
-            target = lines[i + 1].strip()
-            sentiment = lines[i + 2].strip()
-            out_f.writelines([old_sentence + '\n', target + '\n', sentiment + '\n'])
-            new_sentence, target = augment_func(old_sentence, target, sentiment)
-            out_f.writelines([new_sentence + '\n', target + '\n', sentiment + '\n'])
+        if strategy not in ["random", "aspect"]: # these strategies do not use spaCy
+            parse = model_registry.parse_cache(parse_cache_file, parse_processes)
+            sentences = [lines[i].strip() for i in range(0, len(lines) - 1, 3)]
+            targets = [lines[i + 1].strip() for i in range(0, len(lines) - 1, 3)]
+            parse.prime(targets + [re.sub(r'\$T\$', target, sentence) for sentence, target in zip(sentences, targets)])
+        with tqdm(total=(len(lines) + 1) // 3, desc="BERTprepend-augmentation", unit="sentence") as progress:
+            for old_sentence, old_target, sentiment, new_sentence, target in augment_lines(lines, augment_func.steps, chunk_size):
+                out_f.writelines([old_sentence + '\n', old_target + '\n', sentiment + '\n'])
+                out_f.writelines([new_sentence + '\n', target + '\n', sentiment + '\n'])
+                progress.update(1)
+    parse.save()
     return out_file
 
-def unmasker(text, sentiment):
-    """Unmasker based on BERTprepend model"""
+def sentiment_word(sentiment):
     if  sentiment == '-1':
-        sentiment = 'negative'
+        return 'negative'
     elif sentiment == '0':
-        sentiment = 'neutral'
+        return 'neutral'
     elif sentiment == '1':
-        sentiment = 'positive'
-    text = sentiment + " " + text 
-    inputs = tokenizer(text, return_tensors='pt', max_length=100, padding='max_length', truncation=True, add_special_tokens=True)
-    MASK_id = tokenizer.convert_tokens_to_ids(['[MASK]'])[0]
-    input_ids = inputs['input_ids'].long()
-    attention = inputs['attention_mask'].long()
-    all_masked_idx = [(input_ids == MASK_id).nonzero(as_tuple=True)[1].tolist()]
-    model.eval()
-    inputs = {'input_ids': input_ids, # tokens embeddings
-                'attention_mask': attention, # segment embedding
-            }
-    outputs = model(**inputs)
-    predictions = outputs[0]
-    predictions = F.softmax(predictions / 1, dim=2)
-
-
-    for ids, masked_idx, preds in zip(input_ids, all_masked_idx, predictions):
-                for idx in masked_idx:
-                    pred_probs = preds[idx]
-                    pred = torch.multinomial(pred_probs, 2) # obtain the first two predictions
-                    predictions = [t.item() for t in pred] # convert to numpy array
-    preds = []
-    for pred in predictions:
-        decoded_word = tokenizer.convert_ids_to_tokens(pred)
-        preds.append(decoded_word)
-    return preds
+        return 'positive'
+    return sentiment
+
+def unmasker_batch(texts, sentiments):
+    """Unmasker based on BERTprepend model, fills the [MASK] of every text in batched forward passes"""
+    texts = [sentiment_word(sentiment) + " " + text for text, sentiment in zip(texts, sentiments)]
+    predictions = fill_mask_ids(model, tokenizer, texts)
+    return [tokenizer.convert_ids_to_tokens(pred) for pred in predictions]
+
+def unmasker(text, sentiment):
+    """Unmasker based on BERTprepend model"""
+    return unmasker_batch([text], [sentiment])[0]
 
 def is_similar_enough(str1, str2, threshold=0.95):
     ratio = Levenshtein.ratio(str1, str2)
     return ratio >= threshold
 
+@mask_batched
 def augment_random(in_sentence, in_target, sentiment):
     """
     This function augment the sentence randomly according to Devlin et al when trained on MLM tasks.
     """
+    masks = MaskBatch(unmasker_batch, sentiment)
 
     words = tokenizer.tokenize(in_sentence)
     tar = re.findall(r'\w+|[^\s\w]+', in_target)
@@ -161,16 +161,9 @@ def augment_random(in_sentence, in_target, sentiment):
                     cur_sent[i] = '[MASK]'
                 else:
                     cur_sent[i-(3-tar_length)] = '[MASK]'
-                results = unmasker(tokenizer.convert_tokens_to_string(cur_sent), sentiment)
-                predicted_words = []
-                for result in results:
-                    predicted_words.append(result)
-                if predicted_words[0]==masked_word:
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(tokenizer.convert_tokens_to_string(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
 
             # 10% of the time, keep original
             elif rd.random() < 0.5:
@@ -184,15 +177,19 @@ def augment_random(in_sentence, in_target, sentiment):
                 i += 1
 
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
     # augmented_sentence_str = " ".join(augmented_sentence)
     augmented_sentence_str = tokenizer.convert_tokens_to_string(augmented_sentence)
 
     return augmented_sentence_str, in_target
 
+@mask_batched
 def augment_random(in_sentence, in_target, sentiment):
     """
     This code is adapted from https://github.com/S127-Pi/HAABSA_PLUS_PLUS_DA/blob/master/bertPrependAugmentation.py
     """
+    masks = MaskBatch(unmasker_batch, sentiment)
 
     words = tokenizer.tokenize(in_sentence)
     tar = re.findall(r'\w+|[^\s\w]+', in_target)
@@ -252,17 +249,9 @@ def augment_random(in_sentence, in_target, sentiment):
                         cur_sent[i] = '[MASK]'
                     else:
                         cur_sent[i-(3-tar_length)] = '[MASK]'
-                    results = unmasker(tokenizer.convert_tokens_to_string(cur_sent), sentiment)
-                    predicted_words = []
-
-                    for result in results:
-                        predicted_words.append(result)
-                    if predicted_words[0]==masked_word:
-                        augmented_sentence.append(predicted_words[1])
-                        i += 1
-                    else:
-                        augmented_sentence.append(predicted_words[0])
-                        i += 1
+                    slot = masks.add(tokenizer.convert_tokens_to_string(cur_sent), masked_word)
+                    augmented_sentence.append(slot)
+                    i += 1
                 elif 0.8 < prob2 <= 0.9:
                     amount_masked += 1
                     random_token = rd.choice(list(vocab.keys()))
@@ -275,42 +264,44 @@ def augment_random(in_sentence, in_target, sentiment):
                 augmented_sentence.append(words[i])
                 i+=1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
     augmented_sentence_str = ' '.join(augmented_sentence)
 
     return augmented_sentence_str, in_target
 
 
+@mask_batched
 def augment_sentence_aspect(in_sentence, in_target, sentiment):
     """
     This function selective substitute all aspects occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch, sentiment)
     masked_word = in_target
     sentence_mask_target = re.sub(r'\$T\$', "[MASK]", in_sentence, count = 1)
     sentence_mask_target = re.sub(r'\$T\$', in_target, sentence_mask_target)
     
-    predicted_words = unmasker(sentence_mask_target, sentiment)
-    target = ""
-    # print(f"{predicted_words=}")
-    if predicted_words[0] == masked_word: # skip to the next predicted word
-        target = predicted_words[1]
-    else:
-        target = predicted_words[0]
+    target = masks.add(sentence_mask_target, masked_word)
+    yield masks
+    target = resolve(target)
 
     return in_sentence, target
 
 
 
 
+@mask_batched
 def augment_sentence_nouns(in_sentence, in_target,sentiment):
     """
     This function selective substitute all nouns occuring in a sentence
     """
-    tar = nlp(in_target)
+    masks = MaskBatch(unmasker_batch, sentiment)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # replace $t$ with actual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     
     n = len(doc_tokens)
@@ -363,14 +354,9 @@ def augment_sentence_nouns(in_sentence, in_target,sentiment):
                 cur_sent = doc_tokens.copy()
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
-                predicted_words = unmasker(' '.join(cur_sent), sentiment)
-                # print(f"{predicted_words=}")
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -382,6 +368,9 @@ def augment_sentence_nouns(in_sentence, in_target,sentiment):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
@@ -407,17 +396,19 @@ def augment_sentence_nouns(in_sentence, in_target,sentiment):
 
     
 
+@mask_batched
 def augment_sentence_adjective_adverbs(in_sentence, in_target, sentiment):
     """
     This function selective substitute 15% of adverbs or adjectives occuring in a sentence
     """
+    masks = MaskBatch(unmasker_batch, sentiment)
 
-    tar = nlp(in_target)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # substitute $t$ with autual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
 
     n = len(doc_tokens)
@@ -482,14 +473,9 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target, sentiment):
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
                 amount_masked += 1
-                predicted_words = unmasker(' '.join(cur_sent), sentiment)
-                # print(f"{predicted_words=}")
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -502,6 +488,9 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target, sentiment):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
@@ -521,16 +510,18 @@ def augment_sentence_adjective_adverbs(in_sentence, in_target, sentiment):
         raise ValueError
     return augmented_sentence_str, modified_target_str
 
+@mask_batched
 def augment_aspect_adj_adv(in_sentence, in_target, sentiment):
     """
     This function selective substitute all aspect, adjectives and adverbs (15%) occuring in a sentence
     """
-    tar = nlp(in_target)
+    masks = MaskBatch(unmasker_batch, sentiment)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # substitute $t$ with actual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
 
@@ -601,18 +592,11 @@ def augment_aspect_adj_adv(in_sentence, in_target, sentiment):
                     cur_sent[i] = '[MASK]'
                     i += 1
                 amount_masked += 1
-                predicted_words = unmasker(' '.join(cur_sent),sentiment)
-
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    if target:
-                        modified_target = augmented_sentence[-1]
-                        target = False
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    if target:
-                        modified_target = augmented_sentence[-1]
-                        target = False
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                if target:
+                    modified_target = augmented_sentence[-1]
+                    target = False
             elif i in non_cand_idx:
                 augmented_sentence.append(modified_target)
                 curr_idx = len(augmented_sentence) - 1
@@ -623,6 +607,10 @@ def augment_aspect_adj_adv(in_sentence, in_target, sentiment):
                 i += 1
 
     
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+    modified_target = resolve(modified_target)
+
     start = tar_idx[0]
     end = tar_idx[-1]+1
     augmented_sentence [start:end] = ["$T$"]
@@ -638,16 +626,18 @@ def augment_aspect_adj_adv(in_sentence, in_target, sentiment):
         raise ValueError
     return augmented_sentence_str, modified_target
 
+@mask_batched
 def augment_all_noun_adj_adv(in_sentence, in_target, sentiment):
     """
     This function selective substitute all nouns, adjectives and adverbs (15%) occuring in a sentence
     """
-    tar = nlp(in_target)
+    masks = MaskBatch(unmasker_batch, sentiment)
+    tar = parse(in_target)
     tar = [token.text for token in tar]
     sentence_w_target = re.sub(r'\$T\$', in_target, in_sentence) # replace $t$ with actual target
 
     # Tokenize the sequence using spaCy
-    doc = nlp(sentence_w_target)
+    doc = parse(sentence_w_target)
     doc_tokens = [token.text for token in doc] # list of tokens
     #tar_idx = [i for i, token in enumerate(doc_tokens) if any(is_similar_enough(token, t) for t in tar)]
     n = len(doc_tokens)
@@ -710,14 +700,9 @@ def augment_all_noun_adj_adv(in_sentence, in_target, sentiment):
                 cur_sent = doc_tokens.copy()
                 masked_word = doc_tokens[i]
                 cur_sent[i] = '[MASK]'
-                predicted_words = unmasker(' '.join(cur_sent),sentiment)
-                if predicted_words[0] == masked_word: # skip to the next predicted word
-                    augmented_sentence.append(predicted_words[1])
-                    i += 1
-                else:
-                    augmented_sentence.append(predicted_words[0])
-                    cur_sent[i] = predicted_words[0]
-                    i += 1
+                slot = masks.add(' '.join(cur_sent), masked_word)
+                augmented_sentence.append(slot)
+                i += 1
             elif i in non_cand_idx:
                 sub_target = augmented_sentence[tar_idx[j]]
                 augmented_sentence.append(sub_target)
@@ -729,6 +714,9 @@ def augment_all_noun_adj_adv(in_sentence, in_target, sentiment):
                 augmented_sentence.append(doc_tokens[i])
                 i += 1
 
+    yield masks
+    augmented_sentence = resolve(augmented_sentence)
+
     # Extract the modified_aspect based on in_target_idx in the new augmented sentence
     modified_target = tar
     modified_target = [augmented_sentence[idx] for idx in tar_idx]
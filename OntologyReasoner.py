@@ -7,9 +7,17 @@ import numpy as np
 import nltk
 import time
 import os
+import pickle
+import multiprocessing
+from collections import OrderedDict
 from nltk.parse.stanford import StanfordDependencyParser
 from nltk import *
 from config import *
+from negation import DependencyParseCache, has_negation_cue
+import negation
+from utils import write_selected_lines
+from ontology_snapshot import owl_hash, check_subclass, compile_snapshot, load_snapshot, save_snapshot
+from ontology_vocabulary import OntologyVocabulary, load_vocabulary, lemma_types, TYPE1, TYPE2, TYPE3
 
 #path to the java runtime environment for windows
 # nltk.internals.config_java('C:/Program Files/Java/jre1.8.0_171/bin/java.exe')
@@ -17,19 +25,91 @@ from config import *
 # os.environ['JAVAHOME'] = java_path
 # owlready2.JAVA_EXE = 'C:/Program Files/Java/jre1.8.0_171/bin/java.exe'
 
+PUNCTUATION_AND_NUMBERS = ['– ','(', ')', '?', ':', ';', ',', '.', '!', '/', '"', '\'', '’','*', '$', '0', '1', '2', '3',
+                           '4', '5', '6', '7', '8', '9']
+# polarity label in the data files -> one-hot polarity vector of the reasoner
+POLARITY_VECTORS = {'-1': [0, 0, 1], '0': [0, 1, 0], '1': [1, 0, 0]}
+
+
+def clean_sentence(sentence, target):
+    """Lower cased sentence with $T$ replaced by the target and the lower cased target, without punctuation and numbers."""
+    words_tar = target.lower()
+    words = sentence.lower()
+    words = words.replace('$t$', words_tar)
+    #Remove punctuation
+    for _ in PUNCTUATION_AND_NUMBERS:
+        words_tar = words_tar.replace(_, '')
+    for _ in PUNCTUATION_AND_NUMBERS:
+        words = words.replace(_, '')
+    return words, words_tar
+
+
+def ontology_accuracy(predictions, deferred, polarity_vector):
+    """Accuracy of the ontology predictions of OntReasoner.filter on the instances it did not defer."""
+    predicted = ~np.asarray(deferred)
+    if not predicted.any():
+        return 0.
+    return float(np.mean(np.argmax(predictions[predicted], axis=1) == np.argmax(polarity_vector[predicted], axis=1)))
+
+
+class LemmaCache():
+    """
+    Bounded LRU table (word, POS tag) -> WordNet lemma, saved to path so later runs (e.g. cross-validation folds) reuse it.
+    """
+    def __init__(self, path=None, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmas = OrderedDict()
+        self.changed = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.lemmas = pickle.load(f)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                print('Could not read lemma cache ' + path + ', starting with an empty one')
+
+    def lemmatize(self, word, tag):
+        key = (word, tag)
+        lemma = self.lemmas.get(key)
+        if lemma is not None:
+            self.lemmas.move_to_end(key)
+            return lemma
+        if tag.startswith('V'):  # Verb
+            lemma = self.lemmatizer.lemmatize(word, 'v')
+        elif tag.startswith('J'):  # Adjective
+            lemma = self.lemmatizer.lemmatize(word, 'a')
+        elif tag.startswith('R'):  # Adverb
+            lemma = self.lemmatizer.lemmatize(word, 'r')
+        else:  # Default is noun
+            lemma = self.lemmatizer.lemmatize(word)
+        self.lemmas[key] = lemma
+        if len(self.lemmas) > self.maxsize:
+            self.lemmas.popitem(last=False)
+        self.changed = True
+        return lemma
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(self.lemmas, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.changed = False
+
+
 class OntReasoner():
     def __init__(self):
-        onto_path.append("data")  # Path to ontology
-        self.onto = get_ontology("ontology.owl")  # Name of ontology
-        self.onto = self.onto.load()
+        self.owl_file = os.path.join("data", "ontology.owl")  # Path to ontology
+        self._onto = None  # owlready2 ontology, only loaded when the snapshot does not have the answer
         self.timeStart = time.time()
-        self.classes = set(self.onto.classes())
         self.sencount = -1
-        self.my_dict = {}
         self.path_to_jar = 'data/stanford-parser-full-2018-02-27/stanford-parser.jar'
         self.path_to_models_jar = 'data/stanford-parser-full-2018-02-27/stanford-parser-3.9.1-models.jar'
 
         self.dependency_parser = StanfordDependencyParser(path_to_jar=self.path_to_jar, path_to_models_jar=self.path_to_models_jar)
+        self.parse_cache = DependencyParseCache(self.dependency_parser, FLAGS.ontology_parse_cache, FLAGS.ontology_memoize)
 
 
         self.remaining_sentence_vector = []
@@ -42,70 +122,102 @@ class OntReasoner():
 
         self.majority_count = []
 
-        for onto_class in self.classes:
-            self.my_dict[onto_class] = onto_class.lex
+        self.lemma_cache = LemmaCache(FLAGS.ontology_lemma_cache, FLAGS.ontology_lemma_cache_size)
+        self.subclasses = {}  # (property class, target class) -> their common subclass
+        self.sentence_tags = []
 
+        # compiled ontology (lexicon index, types, mentions, subsumptions), see ontology_snapshot
+        snapshot_hash = owl_hash(self.owl_file)
+        self.snapshot = load_snapshot(FLAGS.ontology_snapshot, snapshot_hash)
+        if self.snapshot is None:
+            self.snapshot = compile_snapshot(self.onto, snapshot_hash)
+            save_snapshot(self.snapshot, FLAGS.ontology_snapshot)
+        self.lex_index = self.snapshot.lex_index
+        self.subsumptions = self.snapshot.subsumptions  # (property class, target class) -> (positive, negative) after reasoning
+        self.new_subsumptions = False
+        self.memoize = FLAGS.ontology_memoize  # kept on the reasoner, as classify_parallel workers parse their own flags
+        # (word, POS tag) -> ontology class and type, see ontology_vocabulary
+        self.vocabulary = load_vocabulary(FLAGS.ontology_vocabulary, snapshot_hash) or OntologyVocabulary(snapshot_hash)
 
-    def predict_sentiment(self, sentence, target, onto, use_cabasc, use_svm, posinfo, types1, types2, types3):
-        words_in_sentence = sentence.split()
+
+    @property
+    def onto(self):
+        if self._onto is None:
+            onto_path.append("data")  # Path to ontology
+            self._onto = get_ontology("ontology.owl")  # Name of ontology
+            self._onto = self._onto.load()
+            self._onto_classes = dict((c.__name__, c) for c in self._onto.classes())
+        return self._onto
+
+
+    def onto_class(self, name):
+        self.onto  # loads the ontology and its classes by name
+        return self._onto_classes[name]
+
+
+    def predict_sentiment(self, sentence, target, use_cabasc, use_svm, posinfo, tags=None):
         self.sencount += 1
+        self.record_prediction(self.classify(sentence, target, tags), sentence, target, use_cabasc, use_svm, posinfo)
 
-        lemma_of_words_with_classes, words_with_classes, words_classes, target_class = self.get_class_of_words(words_in_sentence,
-                                                                                                          target)
 
-        positive_class = onto.search(iri='*Positive')[0]
-        negative_class = onto.search(iri='*Negative')[0]
+    def classify(self, sentence, target, tags=None):
+        """
+        Ontology prediction for one sentence: 'positive', 'negative', or None when the ontology cannot decide and the
+        sentence is deferred to the backup method. Only the caches of the reasoner are changed.
+        """
+        words_in_sentence = sentence.split()
+
+        types_of_words_with_classes, words_with_classes, words_classes, target_class = self.get_class_of_words(words_in_sentence,
+                                                                                                          target, tags)
 
         found_positive_list = []
         found_negative_list = []
 
         for x in range(len(words_with_classes)):
             word = words_with_classes[x]
-            lemma_of_word = lemma_of_words_with_classes[x]
+            word_types = types_of_words_with_classes[x]
             word_class = words_classes[x]
             negated = self.is_negated(word, words_in_sentence)
 
-            if lemma_of_word in types1:
-                found_positive, found_negative = self.get_sentiment_of_class(positive_class, negative_class, word_class,
-                                                                        negated, False)
+            if word_types & TYPE1:
+                found_positive, found_negative = self.get_sentiment_of_class(word_class, negated)
                 found_positive_list.append(found_positive)
                 found_negative_list.append(found_negative)
 
-            if lemma_of_word in types2:
+            if word_types & TYPE2:
                 if self.category_matches(target_class, word_class):
-                    found_positive, found_negative = self.get_sentiment_of_class(positive_class, negative_class,
-                                                                            word_class, negated, False)
+                    found_positive, found_negative = self.get_sentiment_of_class(word_class, negated)
                     found_positive_list.append(found_positive)
                     found_negative_list.append(found_negative)
 
-            if lemma_of_word in types3:
-                if target_class is not None:
-                    new_class = self.add_subclass(word_class, target_class)
-                else:
-                    new_class = word_class
-
-                found_positive, found_negative = self.get_sentiment_of_class(positive_class, negative_class, new_class,
-                                                                        negated, True)
+            if word_types & TYPE3:
+                found_positive, found_negative = self.get_sentiment_of_property(word_class, target_class, negated)
                 found_positive_list.append(found_positive)
                 found_negative_list.append(found_negative)
 
         if True in found_positive_list and True not in found_negative_list:
+            return 'positive'
+        elif True not in found_positive_list and True in found_negative_list:
+            return 'negative'
+        return None
+
+
+    def record_prediction(self, prediction, sentence, target, use_cabasc, use_svm, posinfo):
+        if prediction == 'positive':
             self.prediction_vector.append([1, 0, 0])
 
-        elif True not in found_positive_list and True in found_negative_list:
+        elif prediction == 'negative':
             self.prediction_vector.append([0, 0, 1])
         # Create remaining vector for Neural Method
         elif use_cabasc:
-            self.sencount += -1
-            self.polarity_vector = np.delete(self.polarity_vector, self.sencount, 0)
+            self.deferred[self.sencount] = True
             self.remaining_sentence_vector.append(sentence)
             self.remaining_target_vector.append(target)
             self.remaining_pos_vector.extend((posinfo, posinfo+1, posinfo+2))
             print(posinfo, sentence)
         # Create remaining vector for BoW model
         elif use_svm:
-            self.sencount += -1
-            self.polarity_vector = np.delete(self.polarity_vector, self.sencount, 0)
+            self.deferred[self.sencount] = True
             self.remaining_sentence_vector.append(sentence)
             self.remaining_target_vector.append(target)
             self.remaining_pos_vector.extend((int(posinfo/3*4), int((posinfo/3*4)+1), int((posinfo/3*4)+2), int((posinfo/3*4)+3)))
@@ -115,128 +227,156 @@ class OntReasoner():
             self.majority_count.append(1)
 
 
-    def get_class_of_words(self, words_in_sentence, target):
+    def __getstate__(self):
+        # the owlready2 ontology stays in the process that loaded it
+        state = self.__dict__.copy()
+        state['_onto'] = None
+        state.pop('_onto_classes', None)
+        state['subclasses'] = {}
+        return state
+
+
+    def classify_parallel(self, workers):
+        """
+        Classifies all loaded sentences in a pool of worker processes. The dependency parses and the reasoner results
+        are computed up front in this process, so the workers only look them up.
+        """
+        self.precompute_subsumptions()
+        n = len(self.sentence_vector)
+        shard_size = -(-n // (workers * 4)) if n else 1
+        jobs = [(start, min(start + shard_size, n)) for start in range(0, n, shard_size)]
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=init_classify_worker, initargs=(self,)) as pool:
+            shards = pool.map(classify_range, jobs)
+        return [prediction for shard in shards for prediction in shard]
+
+
+    def tag_sentences(self, sentences):
+        """POS tags the words of all sentences at once, every word in the context of its sentence."""
+        return [[tag for _, tag in tagged] for tagged in nltk.pos_tag_sents([sentence.split() for sentence in sentences])]
+
+
+    def label_word(self, word, tag):
+        """Ontology class (None if the lemma of the word has none) and type bits of a word with POS tag."""
+        lemma_of_word = self.lemma_cache.lemmatize(word, tag)
+        lemma_of_word_class = self.lex_index.get(lemma_of_word)
+        if lemma_of_word_class is None:
+            return None, 0
+        return lemma_of_word_class, lemma_types(lemma_of_word, *self.create_types())
+
+
+    def build_vocabulary(self, paths):
+        """Labels every (word, POS tag) in the data files and saves the vocabulary for later runs."""
+        tokens = []
+        for path in paths:
+            sentences, targets, _ = self.read_data(path)
+            cleaned = [clean_sentence(sentence, target)[0] for sentence, target in zip(sentences, targets)]
+            for sentence, tags in zip(cleaned, self.tag_sentences(cleaned)):
+                tokens.extend(zip(sentence.split(), tags))
+        self.vocabulary.add(tokens, self.label_word)
+        self.vocabulary.save(FLAGS.ontology_vocabulary)
+        self.lemma_cache.save()
+
+
+    def get_class_of_words(self, words_in_sentence, target, tags=None):
         self.classes = []
         words_with_classes = []
-        lemma_of_words_with_classes = []
-        wordnet_lemmatizer = WordNetLemmatizer()
+        types_of_words_with_classes = []
         target_class = None
+        if tags is None:
+            tags = [tag for _, tag in nltk.pos_tag(words_in_sentence)]
 
-        for word in words_in_sentence:
-            word_as_list = word_tokenize(word)
-
-            pos_tag = nltk.pos_tag(word_as_list)
-            tag_only = pos_tag[0][1]  # Get tag only
-
-            if tag_only.startswith('V'):  # Verb
-                lemma_of_word = wordnet_lemmatizer.lemmatize(word, 'v')
-            elif tag_only.startswith('J'):  # Adjective
-                lemma_of_word = wordnet_lemmatizer.lemmatize(word, 'a')
-            elif tag_only.startswith('R'):  # Adverb
-                lemma_of_word = wordnet_lemmatizer.lemmatize(word, 'r')
-            else:  # Default is noun
-                lemma_of_word = wordnet_lemmatizer.lemmatize(word)
-
-            for value in list(self.my_dict.values()):
-                if lemma_of_word in value:
-                    lemma_of_word_class = list(self.my_dict.keys())[list(self.my_dict.values()).index(value)]
-                    self.classes.append(lemma_of_word_class)
-                    lemma_of_words_with_classes.append(lemma_of_word)
-                    words_with_classes.append(word)
-                    if word == target:
-                        target_class = lemma_of_word_class
-                    break
-        return lemma_of_words_with_classes, words_with_classes, self.classes, target_class
+        for word, tag_only in zip(words_in_sentence, tags):
+            lemma_of_word_class, word_types = self.vocabulary.get(word, tag_only, self.label_word)
+            if lemma_of_word_class is not None:
+                self.classes.append(lemma_of_word_class)
+                types_of_words_with_classes.append(word_types)
+                words_with_classes.append(word)
+                if word == target:
+                    target_class = lemma_of_word_class
+        return types_of_words_with_classes, words_with_classes, self.classes, target_class
 
 
     def is_negated(self, word, words_in_sentence):
         #negation check with window and dependency graph
-        # path_to_jar = 'data/stanford-parser-full-2018-02-27/stanford-parser.jar'
-        # path_to_models_jar = 'data/stanford-parser-full-2018-02-27/stanford-parser-3.9.1-models.jar'
-
-        # dependency_parser = StanfordDependencyParser(path_to_jar=path_to_jar, path_to_models_jar=path_to_models_jar)
+        return negation.is_negated(word, words_in_sentence, self.parse_cache)
 
-        index = words_in_sentence.index(word)
-        negated = False
 
-        if index < 3:
-            for i in range(index):
-                temp = words_in_sentence[i]
-                if "not" in temp or "n't" in temp or "never" in temp:
-                    negated = True
-        else:
-            for i in range(index - 3, index):
-                temp = words_in_sentence[i]
-                if "not" in temp or "n't" in temp or "never" in temp:
-                    negated = True
-        negations = ["not", "n,t", "never"]
-        if negated == False and any(x in s for x in negations for s in words_in_sentence):
-            print('negation parser')
-            print(' '.join(words_in_sentence))
-            result = self.dependency_parser.raw_parse(' '.join(words_in_sentence))
-            dep = result.__next__()
-            result = list(dep.triples())
-            for triple in result:
-                if triple[0][0] == word and triple [1] == 'neg':
-                    negated = True
-                    break
-        return negated
-
-
-    def get_sentiment_of_class(self, positive_class, negative_class, onto_class, negated, type3):
-        found_positive = False
-        found_negative = False
+    def negate(self, found, negated):
+        if found is None:  # the subclass check failed
+            return False
+        return not found if negated else found
 
-        try:
-            if type3:
-                sync_reasoner()  # Run reasoner
-            found_positive = positive_class.__subclasscheck__(onto_class)
-            if negated:
-                found_positive = not found_positive
-        except AttributeError:
-            pass
 
-        try:
-            if type3:
-                sync_reasoner()
-            found_negative = negative_class.__subclasscheck__(onto_class)
-            if negated:
-                found_negative = not found_negative
-        except AttributeError:
-            pass
+    def get_sentiment_of_class(self, onto_class, negated):
+        found_positive = self.negate(self.snapshot.positive.get(onto_class), negated)
+        found_negative = self.negate(self.snapshot.negative.get(onto_class), negated)
         return found_positive, found_negative
 
 
+    def get_sentiment_of_property(self, property_class, target_class, negated):
+        """
+        Sentiment of a property mention (type 3) about target_class. The reasoner runs once per (property class,
+        target class); later mentions, runs and folds reuse its positive/negative subsumption, unless
+        --ontology_memoize is off.
+        """
+        key = (property_class, target_class)
+        if key not in self.subsumptions or not self.memoize:
+            self.reason_subsumptions([key])
+        found_positive, found_negative = self.subsumptions[key]
+        return self.negate(found_positive, negated), self.negate(found_negative, negated)
+
+
+    def reason_subsumptions(self, pairs):
+        """Creates the subclasses of (property class, target class) pairs and classifies them with one reasoner call."""
+        positive_class = self.onto.search(iri='*Positive')[0]
+        negative_class = self.onto.search(iri='*Negative')[0]
+        new_classes = [self.add_subclass(property_class, target_class) if target_class is not None else self.onto_class(property_class)
+                       for property_class, target_class in pairs]
+        sync_reasoner()  # Run reasoner
+        for pair, new_class in zip(pairs, new_classes):
+            self.subsumptions[pair] = (check_subclass(positive_class, new_class),
+                                       check_subclass(negative_class, new_class))
+        self.new_subsumptions = True
+
+
+    def precompute_subsumptions(self):
+        """
+        Classifies all (property class, target class) pairs in the loaded sentences with a single reasoner call,
+        instead of one call per pair.
+        """
+        pairs = set()
+        for x in range(len(self.sentence_vector)):
+            word_types, _, word_classes, target_class = self.get_class_of_words(self.sentence_vector[x].split(),
+                                                                                self.target_vector[x], self.sentence_tags[x])
+            for types_of_word, word_class in zip(word_types, word_classes):
+                if types_of_word & TYPE3:
+                    pairs.add((word_class, target_class))
+        pairs = sorted((pair for pair in pairs if pair not in self.subsumptions), key=lambda pair: (pair[0], pair[1] or ''))
+        if pairs:
+            self.reason_subsumptions(pairs)
+
+
     def category_matches(self, target_class, onto_class):
         if target_class is None:
             return False
 
-        target_ancestors = target_class.ancestors()
-        target_mentions = []
-        for target_an in target_ancestors:
-            name = target_an.__name__
-            if "Mention" in name:
-                target_mentions.append(name.rsplit('Mention', 1)[0])
-
-        onto_ancestors = onto_class.ancestors()
-        onto_mentions = []
-        for onto_an in onto_ancestors:
-            name = onto_an.__name__
-            if "Mention" in name:
-                onto_mentions.append(name.rsplit('Mention', 1)[0])
-
-        common_list = list(set(target_mentions).intersection(set(onto_mentions)))
+        target_mentions = self.snapshot.mentions[target_class]
+        onto_mentions = self.snapshot.mentions[onto_class]
+
+        common_list = list(target_mentions.intersection(onto_mentions))
         if len(common_list) > 2:  # If they have more than 2 ancestors in common
             return True
         else:
             return False
 
 
-    def add_subclass(self, onto_class, target_class):  # Add new subclass to ontology
-        onto_name = onto_class.__name__
-        target_name = target_class.__name__
-        new_class = types.new_class(onto_name+target_name, (onto_class, target_class))
-        return new_class
+    def add_subclass(self, onto_name, target_name):  # Add new subclass to ontology
+        key = (onto_name, target_name)
+        if key not in self.subclasses:
+            onto_class = self.onto_class(onto_name)
+            target_class = self.onto_class(target_name)
+            self.subclasses[key] = types.new_class(onto_name+target_name, (onto_class, target_class))
+        return self.subclasses[key]
 
 
     def get_related_aspect_mentions(self, onto_class):
@@ -264,78 +404,84 @@ class OntReasoner():
 
 
     def create_types(self):
-        types1 = set()
-        types2 = set()
-        types3 = set()
-
-        classes = list(self.onto.classes())
-
-        for c in classes:
-            name_class = c.__name__
-            remove_words = ['Property', "Mention", "Positive", "Neutral", "Negative"]
-            if any(word in name_class for word in remove_words):
-                continue
-            ancestors = c.ancestors()
-            boolean = 1
-            ancestors_list = []
-            for an in ancestors:
-                name_an = an.__name__
-                ancestors_list.append(name_an)
-            ancestors_list.sort()
-
-            for name_ancestor in ancestors_list:
-                if boolean == 1:
-                    if "Generic" in name_ancestor:
-                        types1.add(name_class.lower())
-                        boolean = 0
-                    elif "Positive" in name_ancestor or "Negative" in name_ancestor:
-                        types2.add(name_class.lower())
-                        boolean = 0
-                    elif "PropertyMention" in name_ancestor:
-                        types3.add(name_class.lower())
-                        boolean = 0
-        return types1, types2, types3
+        return self.snapshot.types1, self.snapshot.types2, self.snapshot.types3
 
-    def run(self, use_backup, path, use_svm, cross_val = False, j = 0):
-        types1, types2, types3 = self.create_types()
-        
-        punctuation_and_numbers = ['– ','(', ')', '?', ':', ';', ',', '.', '!', '/', '"', '\'', '’','*', '$', '0', '1', '2', '3',
-                                       '4', '5', '6', '7', '8', '9']
+    def read_data(self, path):
+        """Sentences, targets and polarity labels of a data file of (sentence, target, polarity) line triples."""
         with open(path, "r") as fd:
             lines = fd.read().splitlines()
-            for i in range(0, len(lines), 3):
-                #polarity
-                if lines[i + 2].strip().split()[0] == '-1':
-                    self.polarity_vector.append([0, 0, 1])
-                elif lines[i + 2].strip().split()[0] == '0':
-                    self.polarity_vector.append([0, 1, 0])
-                elif lines[i + 2].strip().split()[0] == '1':
-                    self.polarity_vector.append([1, 0, 0])
-
-                #load target and sentence
-                words_tar = lines[i + 1].lower()
-                words = lines[i].lower()
-                words = words.replace('$t$', words_tar)
-                #Remove punctuation
-                for _ in punctuation_and_numbers:
-                    words_tar = words_tar.replace(_, '')
-                for _ in punctuation_and_numbers:
-                    words = words.replace(_, '')
-                
-                self.target_vector.append(words_tar)
-                self.sentence_vector.append(words)
-                self.posinfo.append(i)
+        return lines[0::3], lines[1::3], [line.strip().split()[0] for line in lines[2::3]]
+
+
+    def load(self, sentences, targets, polarities):
+        """
+        Cleans and POS tags the sentences (with $T$) and targets, and parses the sentences that may need the dependency
+        parser for negation. Predictions of a previous load are discarded.
+        """
+        self.sentence_vector, self.target_vector, self.polarity_vector = [], [], []
+        for sentence, target, polarity in zip(sentences, targets, polarities):
+            words, words_tar = clean_sentence(sentence, target)
+            self.polarity_vector.append(POLARITY_VECTORS[polarity])
+            self.target_vector.append(words_tar)
+            self.sentence_vector.append(words)
 
         self.sentence_vector = np.array(self.sentence_vector)
         self.target_vector = np.array(self.target_vector)
         self.polarity_vector = np.array(self.polarity_vector)
-        self.posinfo = np.array(self.posinfo)
+        self.posinfo = np.arange(0, 3 * len(self.sentence_vector), 3)  # first line of every sentence in the data file
+        self.deferred = np.zeros(len(self.sentence_vector), dtype=bool)  # sentences left to the backup method
+        self.sencount = -1
+        self.prediction_vector = []
+        self.remaining_sentence_vector, self.remaining_target_vector, self.remaining_pos_vector = [], [], []
+        self.majority_count = []
+
+        self.sentence_tags = self.tag_sentences(self.sentence_vector)
+        # parse all sentences that may need the dependency parser for negation in one go
+        self.parse_cache.parse_all([' '.join(sentence.split()) for sentence in self.sentence_vector if has_negation_cue(sentence.split())])
+        if FLAGS.ontology_precompute_closure:
+            self.precompute_subsumptions()
 
-        for x in range(len(self.sentence_vector)):  # For each sentence
-            self.predict_sentiment(self.sentence_vector[x], self.target_vector[x], self.onto, use_backup, use_svm, self.posinfo[x], types1, types2, types3)
 
+    def predict_loaded(self, use_backup, use_svm):
+        """Classifies the loaded sentences into prediction_vector and the deferred mask, and saves the caches."""
+        if FLAGS.ontology_workers > 1:
+            predictions = self.classify_parallel(FLAGS.ontology_workers)
+            for x in range(len(self.sentence_vector)):  # Record in sentence order, as the serial path does
+                self.sencount += 1
+                self.record_prediction(predictions[x], self.sentence_vector[x], self.target_vector[x], use_backup, use_svm, self.posinfo[x])
+        else:
+            for x in range(len(self.sentence_vector)):  # For each sentence
+                self.predict_sentiment(self.sentence_vector[x], self.target_vector[x], use_backup, use_svm, self.posinfo[x],
+                                       self.sentence_tags[x])
+        self.lemma_cache.save()
+        self.vocabulary.save(FLAGS.ontology_vocabulary)
+        self.parse_cache.save()
+        if self.new_subsumptions:
+            save_snapshot(self.snapshot, FLAGS.ontology_snapshot)
+            self.new_subsumptions = False
         self.prediction_vector = np.array(self.prediction_vector)
 
+
+    def filter(self, sentences, targets, polarities, use_backup=True):
+        """
+        In memory form of run for the two-step method: classifies the test instances (sentence with $T$, target and
+        polarity label, as in the data files) without reading or writing data files, so the backup method can score the
+        deferred instances of the test set it already loaded.
+        :return: (predictions, deferred): one-hot ontology prediction per instance ([1, 0, 0] positive, [0, 0, 1]
+        negative, all zeros when deferred) and the boolean mask of the instances deferred to the backup method
+        """
+        self.load(sentences, targets, polarities)
+        self.predict_loaded(use_backup, False)
+        predictions = np.zeros((len(self.sentence_vector), 3), dtype=int)
+        predictions[~self.deferred] = self.prediction_vector.reshape(-1, 3)
+        return predictions, self.deferred.copy()
+
+
+    def run(self, use_backup, path, use_svm, cross_val = False, j = 0):
+        self.load(*self.read_data(path))
+        self.predict_loaded(use_backup, use_svm)
+        self.polarity_vector = self.polarity_vector[~self.deferred]  # polarities of the sentences predicted above
+
         argmax_pol = np.argmax(self.polarity_vector, axis=1)
         argmax_pred = np.argmax(self.prediction_vector, axis=1)
         bool_vector = np.equal(argmax_pol, argmax_pred)
@@ -354,17 +500,13 @@ class OntReasoner():
         self.remaining_target_vector = np.array(self.remaining_target_vector)
         self.remaining_polarity_vector = np.array(self.remaining_polarity_vector)
         self.remaining_pos_vector = np.array(self.remaining_pos_vector)
+        remaining = set(self.remaining_pos_vector.tolist())
 
             
         # Save the outputs to .txt file
         if use_backup == True:
             print(self.remaining_pos_vector)
-            outF= open(FLAGS.remaining_test_path, "w")
-            with open(FLAGS.test_path, "r") as fd:
-                for i, line in enumerate(fd):
-                    if i in self.remaining_pos_vector:
-                        outF.write(line)
-            outF.close()
+            write_selected_lines(FLAGS.test_path, FLAGS.remaining_test_path, remaining)
         
         # Save the remaining test indices for each year
         try:
@@ -374,27 +516,30 @@ class OntReasoner():
             
         if use_svm == True:
             print(self.remaining_pos_vector)
-            outF= open(FLAGS.remaining_svm_test_path, "w")
-            with open(FLAGS.test_svm_path, "r") as fd:
-                for i, line in enumerate(fd):
-                    if i in self.remaining_pos_vector:
-                        outF.write(line)
+            write_selected_lines(FLAGS.test_svm_path, FLAGS.remaining_svm_test_path, remaining)
 
         if cross_val:
             if use_backup == True:
                 print(self.remaining_pos_vector)
-                outF= open("data/programGeneratedData/crossValidation"+str(FLAGS.year)+'/cross_val_remainder_'+str(j)+'.txt', "w")
-                with open(FLAGS.test_path, "r") as fd:
-                    for i, line in enumerate(fd):
-                        if i in self.remaining_pos_vector:
-                            outF.write(line)
-                outF.close()
+                write_selected_lines(FLAGS.test_path, "data/programGeneratedData/crossValidation"+str(FLAGS.year)+'/cross_val_remainder_'+str(j)+'.txt', remaining)
             if use_svm == True:
                 print(self.remaining_pos_vector)
-                outF= open("data/programGeneratedData/crossValidation"+str(FLAGS.year)+'/svm/cross_val_remainder_'+str(j)+'.txt', "w")
-                with open(FLAGS.test_svm_path, "r") as fd:
-                    for i, line in enumerate(fd):
-                        if i in self.remaining_pos_vector:
-                            outF.write(line)
+                write_selected_lines(FLAGS.test_svm_path, "data/programGeneratedData/crossValidation"+str(FLAGS.year)+'/svm/cross_val_remainder_'+str(j)+'.txt', remaining)
+
+        return accuracy, len(self.remaining_pos_vector)/3
+
+
+# reasoner of a classify_parallel worker process
+_worker_reasoner = None
+
+
+def init_classify_worker(reasoner):
+    global _worker_reasoner
+    _worker_reasoner = reasoner
+
 
-        return accuracy, len(self.remaining_pos_vector)/3
\ No newline at end of file
+def classify_range(job):
+    start, end = job
+    r = _worker_reasoner
+    return [r.classify(r.sentence_vector[x], r.target_vector[x], r.sentence_tags[x])
+            for x in range(start, end)]
\ No newline at end of file
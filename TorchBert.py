@@ -4,7 +4,14 @@
 import pandas as pd
 import numpy as np
 import torch
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import multiprocessing
 from config import *
+from utils import W2vTextWriter, W2vBinaryWriter
 from tqdm import tqdm
 
 # from google.colab import files
@@ -12,9 +19,23 @@ from tqdm import tqdm
 # pip install transformers
 
 from transformers import BertModel, BertTokenizer
-model = BertModel.from_pretrained('bert-base-uncased',
-           output_hidden_states = True,)
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+
+BERT_MODEL = 'bert-base-uncased'
+# part of the embedding cache keys, raised whenever the embeddings of a sentence change
+EMBEDDING_VERSION = 2
+_bert = None
+
+def load_bert():
+  """
+  Loads the BERT model and tokenizer once per process.
+  """
+  global _bert
+  if _bert is None:
+    model = BertModel.from_pretrained(BERT_MODEL,
+               output_hidden_states = True,)
+    tokenizer = BertTokenizer.from_pretrained(BERT_MODEL)
+    _bert = (model, tokenizer)
+  return _bert
 
 def bert_text_preparation(text, tokenizer):
   """
@@ -29,51 +50,35 @@ def bert_text_preparation(text, tokenizer):
   segments_tensor = torch.tensor([segments_ids])
   return tokenized_text, tokens_tensor, segments_tensor
 
-def get_bert_embeddings(tokens_tensor, segments_tensor, model):
+def get_bert_embeddings(batch_tokens, model, tokenizer):
     """
-    Obtains BERT embeddings for tokens.
+    Obtains BERT embeddings for a batch of tokenized sentences.
+    Sentences are padded to the longest one in the batch and padding is masked out.
+    Returns one [Y x 768] tensor per sentence, where Y is the number of tokens in that sentence.
     """
+    lengths = [len(tokens) for tokens in batch_tokens]
+    max_len = max(lengths)
+    indexed_tokens = torch.zeros((len(batch_tokens), max_len), dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_tokens), max_len), dtype=torch.long)
+    for row, tokens in enumerate(batch_tokens):
+        indexed_tokens[row, :lengths[row]] = torch.tensor(tokenizer.convert_tokens_to_ids(tokens))
+        attention_mask[row, :lengths[row]] = 1
     # gradient calculation id disabled
     with torch.no_grad():
-      # obtain hidden states
-      outputs = model(tokens_tensor, segments_tensor)
+      # obtain hidden states; the single sentence version passed its all ones segment tensor as attention mask, so the
+      # token type ids are left at their default of all 0
+      outputs = model(indexed_tokens, attention_mask=attention_mask)
       hidden_states = outputs[2]
-    # concatenate the tensors for all layers
-    # use "stack" to create new dimension in tensor
-    token_embeddings = torch.stack(hidden_states, dim=0)
-    # remove dimension 1, the "batches"
-    token_embeddings = torch.squeeze(token_embeddings, dim=1)
-    # swap dimensions 0 and 1 so we can loop over tokens
-    token_embeddings = token_embeddings.permute(1,0,2)
-    # intialized list to store embeddings
-    token_vecs_sum = []
-    # "token_embeddings" is a [Y x 12 x 768] tensor
-    # where Y is the number of tokens in the sentence
-    # loop over tokens in sentence
-    for token in token_embeddings:
-    # "token" is a [12 x 768] tensor
-    # sum the vectors from the last four layers
-        sum_vec = torch.sum(token[-4:], dim=0)
-        token_vecs_sum.append(sum_vec)
-    return token_vecs_sum
-
-# upload = files.upload()  # raw2016forBERT
-
-#get the number of lines in the file
-lines = open(f'{FLAGS.complete_data_file}', errors='replace').readlines()
-sentences = int(len(lines)/3)
-print(len(lines)/3)
-
-from collections import OrderedDict
-context_embeddings = []
-context_tokens = []
-# Change outfile name to embedding_path in config
-lines = open(f'{FLAGS.complete_data_file}', errors='replace').readlines()
-firstline = True
-with open(f'{FLAGS.bert_embedding_path}', 'w', encoding='utf-8') as f:
-    word_counts = {}
-    for i in tqdm(range(0 * 3, sentences * 3, 3), desc=f"Creating BERT Embeddings of {FLAGS.complete_data_file}", unit="sentence"):  # len(lines): 2530 for 2016, 4410 for BERT-models, 8170 for EDA-adjusted, 10050 for EDA-original
-        # print("sentence: " + str(i / 3) + " out of " + str(len(lines) / 3) + " in " + "raw_data;")
+    # sum the vectors from the last four layers, [batch x max_len x 768]
+    token_vecs_sum = torch.stack(hidden_states[-4:], dim=0).sum(dim=0)
+    return [token_vecs_sum[row, :lengths[row]] for row in range(len(batch_tokens))]
+
+def read_sentences(lines):
+    """
+    Rebuilds the full sentence (target put back in place of $t$) for every sentence in the raw data lines.
+    """
+    sentences = []
+    for i in range(0, len(lines) - 2, 3):
         target = lines[i + 1].lower().split()
         words = lines[i].lower().split()
         words_l, words_r = [], []
@@ -86,39 +91,203 @@ with open(f'{FLAGS.bert_embedding_path}', 'w', encoding='utf-8') as f:
                 words_l.append(word)
             else:
                 words_r.append(word)
-        sentence = " ".join(words_l + target + words_r)
-        tokenized_text, tokens_tensor, segments_tensors = bert_text_preparation(sentence, tokenizer)
-        list_token_embeddings = get_bert_embeddings(tokens_tensor, segments_tensors, model)
-        # make ordered dictionary to keep track of the position of each   word
-        tokens = OrderedDict()
-
-
-        # loop over tokens in sensitive sentence
-        for token in tokenized_text[1:-1]:
-          # keep track of position of word and whether it occurs multiple times
-          if token in tokens:
-            tokens[token] += 1
-          else:
-            tokens[token] = 1
-          count = word_counts.get(token, -1) + 1
-          word_counts[token] = count
-        # compute the position of the current token
-          token_indices = [i for i, t in enumerate(tokenized_text) if t == token]
-          current_index = token_indices[tokens[token]-1]
-        # get the corresponding embedding
-          token_vec = list_token_embeddings[current_index]
-          token_vec_array = token_vec.numpy()
-
-        # save values
-        #  context_tokens.append(token)
-        #  context_embeddings.append(token_vec)
-          if not firstline:
-            f.write('\n%s_%s ' % (token, count))
-            f.write(' '.join(map(str, token_vec_array)))
-          else:
-             f.write('%s_%s ' % (token, count))
-             f.write(' '.join(map(str, token_vec_array)))
-             firstline = False
-
-#Change filename to file for download
-# files.download('BERT768embedding2015_none.txt')
\ No newline at end of file
+        sentences.append(" ".join(words_l + target + words_r))
+    return sentences
+
+class EmbeddingCache(object):
+    """
+    Sentence level cache of BERT embeddings on disk, keyed by a hash of the model id, EMBEDDING_VERSION and the tokenized
+    sentence.
+    The original train sentences and the test set are the same for every DA type, so after the first run only the
+    augmented sentences still go through BERT.
+    """
+    def __init__(self, path, model_id):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # the timeout lets the workers of the sharded extraction wait for each other's writes
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vectors BLOB)')
+        self.model_id = model_id
+
+    def key(self, tokenized_text):
+        return hashlib.sha1(('%s\n%d\n%s' % (self.model_id, EMBEDDING_VERSION, ' '.join(tokenized_text))).encode('utf-8')).hexdigest()
+
+    def get(self, pool):
+        """
+        Returns the cached embeddings of every tokenized sentence in pool, None for sentences not in the cache.
+        """
+        keys = [self.key(tokenized_text) for tokenized_text in pool]
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            query = 'SELECT key, vectors FROM embeddings WHERE key IN (%s)' % ','.join('?' * len(chunk))
+            found.update(self.db.execute(query, chunk).fetchall())
+        return [None if key not in found else
+                torch.from_numpy(np.frombuffer(found[key], dtype=np.float32).reshape(len(tokenized_text), -1).copy())
+                for key, tokenized_text in zip(keys, pool)]
+
+    def put(self, pool, embeddings):
+        self.db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?)',
+                            [(self.key(tokenized_text), token_vecs.numpy().astype(np.float32).tobytes())
+                             for tokenized_text, token_vecs in zip(pool, embeddings)])
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def embed_sentences(sentences, model, tokenizer, batch_size, sort_pool, cache=None):
+    """
+    Yields (tokenized_text, token embeddings) for every sentence, in the original order.
+    Sentences are tokenized and sorted on length within pools of sort_pool batches, so that every batch holds
+    sentences of similar length and little padding is needed, while only one pool is kept in memory.
+    With a cache, only the sentences that are not in the cache are run through BERT, and their embeddings are added.
+    """
+    pool_size = batch_size * sort_pool
+    for start in range(0, len(sentences), pool_size):
+        pool = [tokenizer.tokenize("[CLS] " + sentence + " [SEP]") for sentence in sentences[start:start + pool_size]]
+        embeddings = cache.get(pool) if cache is not None else [None] * len(pool)
+        missing = [idx for idx in range(len(pool)) if embeddings[idx] is None]
+        order = sorted(missing, key=lambda idx: len(pool[idx]))
+        for b in range(0, len(order), batch_size):
+            batch = order[b:b + batch_size]
+            for idx, token_vecs in zip(batch, get_bert_embeddings([pool[idx] for idx in batch], model, tokenizer)):
+                embeddings[idx] = token_vecs
+        if cache is not None and missing:
+            cache.put([pool[idx] for idx in missing], [embeddings[idx] for idx in missing])
+        for tokenized_text, token_vecs in zip(pool, embeddings):
+            yield tokenized_text, token_vecs
+
+def token_ids(tokens, word_counts):
+    """
+    Assigns every token of a sentence (without [CLS] and [SEP]) its token_count id, in one pass over the sentence.
+    The vector of the i-th returned id is at position i + 1 of the sentence embeddings.
+    """
+    ids = []
+    for token in tokens:
+        count = word_counts.get(token, -1) + 1
+        word_counts[token] = count
+        ids.append('%s_%s' % (token, count))
+    return ids
+
+def open_writer():
+  if FLAGS.bert_embedding_format == 'binary':
+    return W2vBinaryWriter(FLAGS.bert_embedding_path, FLAGS.embedding_dim)
+  return W2vTextWriter(FLAGS.bert_embedding_path, FLAGS.embedding_dim)
+
+def open_cache(cache_file):
+  if not cache_file:
+    return None
+  return EmbeddingCache(cache_file, BERT_MODEL)
+
+def run_serial(lines):
+  model, tokenizer = load_bert()
+  sentences = int(len(lines)/3)
+  writer = open_writer()
+  cache = open_cache(FLAGS.bert_cache_file)
+  word_counts = {}
+  embeddings = embed_sentences(read_sentences(lines), model, tokenizer, FLAGS.bert_batch_size, FLAGS.bert_sort_pool, cache)
+  for tokenized_text, list_token_embeddings in tqdm(embeddings, total=sentences, desc=f"Creating BERT Embeddings of {FLAGS.complete_data_file}", unit="sentence"):  # len(lines): 2530 for 2016, 4410 for BERT-models, 8170 for EDA-adjusted, 10050 for EDA-original
+    writer.write(token_ids(tokenized_text[1:-1], word_counts), list_token_embeddings[1:-1].numpy())
+  writer.close()
+  if cache is not None:
+    cache.close()
+
+def shard_paths(shard_dir, shard):
+  return os.path.join(shard_dir, 'shard_%d_tokens.txt' % shard), os.path.join(shard_dir, 'shard_%d_vectors.npy' % shard)
+
+def init_shard_worker(threads):
+  # pin the torch threads, so the workers do not oversubscribe the cores
+  torch.set_num_threads(threads)
+
+def embed_shard(job):
+  """
+  Embeds one shard of sentences and saves its (not yet numbered) tokens and their vectors in the shard directory.
+  """
+  shard, sentences, shard_dir, batch_size, sort_pool, cache_file = job
+  model, tokenizer = load_bert()
+  cache = open_cache(cache_file)
+  tokens_path, vectors_path = shard_paths(shard_dir, shard)
+  vectors = [np.zeros((0, FLAGS.embedding_dim), dtype=np.float32)]
+  with open(tokens_path + '.tmp', 'w', encoding='utf-8') as f:
+    for tokenized_text, list_token_embeddings in embed_sentences(sentences, model, tokenizer, batch_size, sort_pool, cache):
+      f.write(' '.join(tokenized_text[1:-1]) + '\n')
+      vectors.append(list_token_embeddings[1:-1].numpy())
+  if cache is not None:
+    cache.close()
+  with open(vectors_path + '.tmp', 'wb') as f:
+    np.save(f, np.concatenate(vectors).astype(np.float32))
+  os.replace(tokens_path + '.tmp', tokens_path)
+  os.replace(vectors_path + '.tmp', vectors_path)
+  return shard
+
+def run_sharded(lines, n_shards, n_workers):
+  """
+  Splits the sentences into n_shards shards and embeds them in a pool of n_workers processes. Finished shards are
+  recorded in a manifest, so a rerun after a crash only embeds the missing shards. The shards are merged in order and
+  numbered afterwards, which gives the same token_count ids as the serial run.
+  """
+  shard_dir = os.path.join(FLAGS.temp_bert_dir, f'{FLAGS.da_type}_{FLAGS.year}_shards')
+  manifest_path = os.path.join(shard_dir, 'manifest.json')
+  stat = os.stat(FLAGS.complete_data_file)
+  key = {'data_file': FLAGS.complete_data_file, 'size': stat.st_size, 'mtime': stat.st_mtime, 'shards': n_shards,
+         'batch_size': FLAGS.bert_batch_size, 'version': EMBEDDING_VERSION}
+  manifest = {'key': key, 'done': []}
+  if os.path.isfile(manifest_path):
+    with open(manifest_path) as f:
+      previous = json.load(f)
+    if previous['key'] == key:
+      manifest = previous
+      print(f"Resuming: {len(manifest['done'])} of {n_shards} shards already done")
+  os.makedirs(shard_dir, exist_ok=True)
+
+  def save_manifest():
+    with open(manifest_path + '.tmp', 'w') as f:
+      json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+  save_manifest()
+
+  sentences = read_sentences(lines)
+  shard_size = -(-len(sentences) // n_shards)
+  jobs = [(shard, sentences[shard * shard_size:(shard + 1) * shard_size], shard_dir, FLAGS.bert_batch_size, FLAGS.bert_sort_pool,
+           FLAGS.bert_cache_file)
+          for shard in range(n_shards) if shard not in manifest['done']]
+  if jobs:
+    threads = max(1, (os.cpu_count() or 1) // n_workers)
+    with multiprocessing.get_context('spawn').Pool(n_workers, initializer=init_shard_worker, initargs=(threads,)) as pool:
+      for shard in tqdm(pool.imap_unordered(embed_shard, jobs), total=len(jobs), desc=f"Creating BERT Embeddings of {FLAGS.complete_data_file}", unit="shard"):
+        manifest['done'].append(shard)
+        save_manifest()
+
+  # merge the shards in order
+  writer = open_writer()
+  word_counts = {}
+  for shard in range(n_shards):
+    tokens_path, vectors_path = shard_paths(shard_dir, shard)
+    vectors = np.load(vectors_path, mmap_mode='r')
+    offset = 0
+    with open(tokens_path, encoding='utf-8') as f:
+      for line in f:
+        tokens = line.split()
+        writer.write(token_ids(tokens, word_counts), vectors[offset:offset + len(tokens)])
+        offset += len(tokens)
+    del vectors
+  writer.close()
+  shutil.rmtree(shard_dir)
+
+def main():
+  # upload = files.upload()  # raw2016forBERT
+
+  #get the number of lines in the file
+  lines = open(f'{FLAGS.complete_data_file}', errors='replace').readlines()
+  print(len(lines)/3)
+
+  # Change outfile name to embedding_path in config
+  if FLAGS.bert_shards > 1:
+    run_sharded(lines, FLAGS.bert_shards, FLAGS.bert_workers)
+  else:
+    run_serial(lines)
+
+  #Change filename to file for download
+  # files.download('BERT768embedding2015_none.txt')
+
+if __name__ == '__main__':
+  main()
@@ -1,5 +1,6 @@
 #!/bin/bash
 
+# Same sweep in one Python process, keeping models loaded: python sweep.py --sweep_stages augment
 years=(2015 2016)
 
 # List of DA types
@@ -0,0 +1,177 @@
+'''
+Benchmark of the ontology reasoner (OntologyReasoner.py). For every year in --sweep_years, OntReasoner.filter classifies
+the ontology test data once per mode in --ontology_benchmark_modes, each run in a fresh process:
+    uncached: the parse, lemma and vocabulary caches and the compiled ontology are disabled, and so are the batched
+              dependency parsing and the reuse of parses and subsumptions within the run (--ontology_memoize)
+    cold: caches in an empty temporary directory, which the run fills
+    warm: the caches filled by the runs before it
+Every stage is timed and counted. Stage timings are inclusive: e.g. the lexicon lookup includes the lemmatising it
+triggers. Stages that run in worker processes (--ontology_workers) are not timed. The table also reports sentences per
+second and the peak resident set size of the Python process and of its child processes (the Java dependency parser).
+The results are appended to --ontology_benchmark_file together with the NLTK and owlready2 versions and the hash of
+the OWL file, so runs before and after an upgrade can be compared.
+Unlike OntReasoner.run, the benchmark does not write the remaining test data or remaining_test_indices_<year>.npy.
+
+Example: python benchmark_ontology.py --sweep_years 2015,2016 --ontology_benchmark_modes uncached,cold,warm
+'''
+from config import *
+import csv
+import functools
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+import multiprocessing
+from sweep import split_flag
+
+MODES = ['uncached', 'cold', 'warm']
+# flags of the files the ontology reasoner keeps between runs
+CACHE_FLAGS = ['ontology_parse_cache', 'ontology_snapshot', 'ontology_lemma_cache', 'ontology_vocabulary']
+
+
+def stage_functions():
+    """(stage, owner, attribute) of every function that is timed."""
+    import OntologyReasoner
+    import negation
+    import ontology_vocabulary
+    reasoner = OntologyReasoner.OntReasoner
+    return [('file I/O', reasoner, 'read_data'),
+            ('file I/O', OntologyReasoner, 'load_snapshot'),
+            ('file I/O', OntologyReasoner, 'save_snapshot'),
+            ('file I/O', OntologyReasoner, 'load_vocabulary'),
+            ('file I/O', OntologyReasoner.LemmaCache, 'save'),
+            ('file I/O', negation.DependencyParseCache, 'save'),
+            ('file I/O', ontology_vocabulary.OntologyVocabulary, 'save'),
+            ('ontology compile', OntologyReasoner, 'compile_snapshot'),
+            ('POS tagging', reasoner, 'tag_sentences'),
+            ('lexicon lookup', reasoner, 'get_class_of_words'),
+            ('lemmatising', OntologyReasoner.LemmaCache, 'lemmatize'),
+            ('negation parsing', negation.DependencyParseCache, 'parse_all'),
+            ('negation parsing', negation.DependencyParseCache, 'triples'),
+            ('reasoner calls', OntologyReasoner, 'sync_reasoner'),
+            ('subclass creation', reasoner, 'add_subclass'),
+            ('classification', reasoner, 'classify')]
+
+
+# stages of stage_functions, in the order they are reported
+STAGES = ['file I/O', 'ontology compile', 'POS tagging', 'lexicon lookup', 'lemmatising', 'negation parsing',
+          'reasoner calls', 'subclass creation', 'classification']
+
+
+class StageTimer():
+    """Total seconds and number of calls per stage of the functions it instruments."""
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.)
+        self.calls = dict.fromkeys(STAGES, 0)
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+        return timed
+
+    def instrument(self, functions):
+        for stage, owner, name in functions:
+            setattr(owner, name, self.wrap(stage, getattr(owner, name)))
+
+
+def peak_rss_mb(who):
+    return resource.getrusage(who).ru_maxrss / 1024.  # kilobytes on Linux
+
+
+def run_benchmark(job):
+    """Runs the ontology reasoner on the test data of one year, in one mode, with its caches in cache_dir."""
+    year, mode, cache_dir = job
+    set_year_and_da_type(year, FLAGS.da_type)
+    for name in CACHE_FLAGS:
+        setattr(FLAGS, name, '' if mode == 'uncached' else os.path.join(cache_dir, name))
+    FLAGS.ontology_memoize = mode != 'uncached'
+
+    import OntologyReasoner
+    timer = StageTimer()
+    timer.instrument(stage_functions())
+    start = time.perf_counter()
+    reasoner = OntologyReasoner.OntReasoner()
+    # filter instead of run, which would overwrite the remaining test data and indices of the pipeline
+    predictions, deferred = reasoner.filter(*reasoner.read_data(FLAGS.test_path_ont))
+    seconds = time.perf_counter() - start
+    accuracy = OntologyReasoner.ontology_accuracy(predictions, deferred, reasoner.polarity_vector)
+    return {'year': year, 'mode': mode, 'sentences': len(reasoner.sentence_vector), 'seconds': seconds,
+            'accuracy': accuracy, 'remaining': int(deferred.sum()), 'stage_seconds': timer.seconds, 'stage_calls': timer.calls,
+            'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF), 'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def versions():
+    from ontology_snapshot import owl_hash
+    return {'nltk': metadata.version('nltk'), 'owlready2': metadata.version('owlready2'),
+            'owl_hash': owl_hash(os.path.join('data', 'ontology.owl'))}
+
+
+def print_results(results):
+    columns = ['%s %s' % (r['year'], r['mode']) for r in results]
+    width = max(len(stage) for stage in STAGES + ['children peak RSS'])
+    print('\n' + ' '.join(['stage'.ljust(width)] + [c.rjust(20) for c in columns]))
+    for stage in STAGES:
+        print(' '.join([stage.ljust(width)] + [('%.2fs (%d)' % (r['stage_seconds'][stage], r['stage_calls'][stage])).rjust(20)
+                                                for r in results]))
+    rows = [('total', lambda r: '%.2fs' % r['seconds']),
+            ('sentences/s', lambda r: '%.1f' % (r['sentences'] / r['seconds'])),
+            ('peak RSS', lambda r: '%.0f MB' % r['peak_rss_mb']),
+            ('children peak RSS', lambda r: '%.0f MB' % r['children_peak_rss_mb']),
+            ('accuracy', lambda r: '%.4f' % r['accuracy']),
+            ('remaining', lambda r: '%d' % r['remaining'])]
+    for name, cell in rows:
+        print(' '.join([name.ljust(width)] + [cell(r).rjust(20) for r in results]))
+
+
+def write_results(results, path):
+    """Appends one row per run and stage to the CSV file at path."""
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new_file = not os.path.isfile(path)
+    info = versions()
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['date', 'nltk', 'owlready2', 'owl_hash', 'year', 'mode', 'stage', 'calls', 'seconds',
+                             'sentences_per_second', 'peak_rss_mb', 'children_peak_rss_mb'])
+        for r in results:
+            run = [date, info['nltk'], info['owlready2'], info['owl_hash'], r['year'], r['mode']]
+            writer.writerow(run + ['total', r['sentences'], '%.4f' % r['seconds'], '%.2f' % (r['sentences'] / r['seconds']),
+                                   '%.1f' % r['peak_rss_mb'], '%.1f' % r['children_peak_rss_mb']])
+            for stage in STAGES:
+                writer.writerow(run + [stage, r['stage_calls'][stage], '%.4f' % r['stage_seconds'][stage], '', '', ''])
+
+
+def main():
+    modes = split_flag(FLAGS.ontology_benchmark_modes)
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError('Unknown benchmark modes: ' + ', '.join(sorted(unknown)))
+    results = []
+    for year in [int(year) for year in split_flag(FLAGS.sweep_years)]:
+        cache_dir = tempfile.mkdtemp(prefix='ontology_benchmark_')
+        try:
+            for mode in modes:
+                print(f'Benchmarking the ontology reasoner for {year} {mode}')
+                # a fresh process per run, so the peak RSS and the in-memory caches are those of the run only
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results.append(pool.submit(run_benchmark, (year, mode, cache_dir)).result())
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    print_results(results)
+    write_results(results, FLAGS.ontology_benchmark_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,36 @@ import sys
 
 
 FLAGS = tf.app.flags.FLAGS
+
+# string flags whose default is derived from other flags (year, da_type, ...), in definition order
+derived_paths = []
+
+
+def define_path(name, default, docstring):
+    """
+    Defines a string flag whose value is default(), and remembers default so the flag can be derived again. Reading
+    FLAGS parses the command line, so default() is only called by derive_paths, once every flag is defined.
+    """
+    tf.app.flags.DEFINE_string(name, '', docstring + ' (default derived from the other flags)')
+    derived_paths.append((name, default))
+
+
+def derive_paths():
+    """Sets the derived paths that were not given on the command line, in definition order."""
+    for name, default in derived_paths:
+        if not FLAGS[name].present:
+            setattr(FLAGS, name, default())
+
+
+def set_year_and_da_type(year, da_type):
+    """
+    Points FLAGS at another year and DA type, as if the program was started with --year and --da_type. Derived paths
+    that were given on the command line are kept.
+    """
+    FLAGS.year = year
+    FLAGS.da_type = da_type
+    derive_paths()
+
 #general variables
 tf.app.flags.DEFINE_string('embedding_type', 'BERT','can be: glove, word2vec-cbow, word2vec-SG, fasttext, BERT, BERT_Large, ELMo')
 tf.app.flags.DEFINE_integer("year", 2015, "year data set [2015/2016]")
@@ -38,37 +68,49 @@ tf.app.flags.DEFINE_float('l2_reg', 0.01, 'l2 regularization')
 
 tf.app.flags.DEFINE_boolean('do_create_raw_files', True, 'whether raw files have to be created, always true when running model for first time') # these three booleans should genreally have the same value (except when troubleshooting)
 tf.app.flags.DEFINE_boolean('do_create_augmentation_files', True, 'whether the augmentation file should be made, always true for first time using a DA method')
-tf.app.flags.DEFINE_string('augmentation_file_path', 'data/programGeneratedData/'+FLAGS.da_type+'_augmented_data' + str(FLAGS.year)+'.txt', 'augmented train file')
+define_path('augmentation_file_path', lambda: 'data/programGeneratedData/'+FLAGS.da_type+'_augmented_data' + str(FLAGS.year)+'.txt', 'augmented train file')
 
 # raw data files
 tf.app.flags.DEFINE_string('raw_data_dir', 'data/programGeneratedData/raw_data/', 'folder contataining raw data')
-tf.app.flags.DEFINE_string('complete_data_file', FLAGS.raw_data_dir + FLAGS.da_type + '_' +'raw_data'+str(FLAGS.year)+'.txt', 'raw data file for retrieving BERT embeddings, contains both train and test data')
-tf.app.flags.DEFINE_string('raw_data_train', FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_train.txt', 'file raw train data is written to')
-tf.app.flags.DEFINE_string('raw_data_test', FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_test.txt', 'file raw test data is written to')
-tf.app.flags.DEFINE_string('raw_data_augmented', FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_augm.txt', 'file raw augmented data is written to')
+define_path('complete_data_file', lambda: FLAGS.raw_data_dir + FLAGS.da_type + '_' +'raw_data'+str(FLAGS.year)+'.txt', 'raw data file for retrieving BERT embeddings, contains both train and test data')
+define_path('raw_data_train', lambda: FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_train.txt', 'file raw train data is written to')
+define_path('raw_data_test', lambda: FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_test.txt', 'file raw test data is written to')
+define_path('semeval_raw_dir', lambda: FLAGS.raw_data_dir + 'semeval/', 'folder of the raw text of every SemEval XML file, shared by all DA types and only remade when the XML file changes')
+tf.app.flags.DEFINE_integer('raw_workers', 4, 'number of processes the SemEval XML files are converted to raw text in')
+define_path('raw_data_augmented', lambda: FLAGS.raw_data_dir + FLAGS.da_type + '_' + 'raw_data'+str(FLAGS.year)+'_augm.txt', 'file raw augmented data is written to')
 
 # traindata, testdata and embeddings, train path aangepast met ELMo
-tf.app.flags.DEFINE_string("train_path_ont", "data/programGeneratedData/GloVetraindata"+str(FLAGS.year)+".txt", "train data path for ont")
-tf.app.flags.DEFINE_string("test_path_ont", "data/programGeneratedData/GloVetestdata"+str(FLAGS.year)+".txt", "formatted test data path")
-tf.app.flags.DEFINE_string("train_path", "data/programGeneratedData/" + str(FLAGS.embedding_type) +str(FLAGS.embedding_dim)+'traindata'+str(FLAGS.year)+'_'+str(FLAGS.da_type)+".txt", "train data path")
-tf.app.flags.DEFINE_string("test_path", "data/programGeneratedData/" + str(FLAGS.embedding_type) + str(FLAGS.embedding_dim)+'testdata'+str(FLAGS.year)+'_'+str(FLAGS.da_type)+".txt", "formatted test data path")
+define_path("train_path_ont", lambda: "data/programGeneratedData/GloVetraindata"+str(FLAGS.year)+".txt", "train data path for ont")
+define_path("test_path_ont", lambda: "data/programGeneratedData/GloVetestdata"+str(FLAGS.year)+".txt", "formatted test data path")
+define_path("train_path", lambda: "data/programGeneratedData/" + str(FLAGS.embedding_type) +str(FLAGS.embedding_dim)+'traindata'+str(FLAGS.year)+'_'+str(FLAGS.da_type)+".txt", "train data path")
+define_path("test_path", lambda: "data/programGeneratedData/" + str(FLAGS.embedding_type) + str(FLAGS.embedding_dim)+'testdata'+str(FLAGS.year)+'_'+str(FLAGS.da_type)+".txt", "formatted test data path")
 
-tf.app.flags.DEFINE_string("embedding_path", "data/programGeneratedData/" + str(FLAGS.embedding_type) + str(FLAGS.embedding_dim)+'embedding'+str(FLAGS.year)+ '_'+ str(FLAGS.da_type)+".txt", "pre-trained glove vectors file path")
+define_path("embedding_path", lambda: "data/programGeneratedData/" + str(FLAGS.embedding_type) + str(FLAGS.embedding_dim)+'embedding'+str(FLAGS.year)+ '_'+ str(FLAGS.da_type)+".txt", "pre-trained glove vectors file path")
 
-tf.app.flags.DEFINE_string("remaining_test_path_ELMo", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingtestdata'+str(FLAGS.year)+"ELMo.txt", "only for printing")
-tf.app.flags.DEFINE_string("remaining_test_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingtestdata'+"_"+str(FLAGS.da_type)+"_"+str(FLAGS.year)+".txt", "formatted remaining test data path after ontology")
+define_path("remaining_test_path_ELMo", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingtestdata'+str(FLAGS.year)+"ELMo.txt", "only for printing")
+define_path("remaining_test_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingtestdata'+"_"+str(FLAGS.da_type)+"_"+str(FLAGS.year)+".txt", "formatted remaining test data path after ontology")
 
 #toegevoegd vanaf arthur
-tf.app.flags.DEFINE_string('bert_embedding_path', 'data/programGeneratedData/bert_embeddings/BERT_base_'+str(FLAGS.da_type) + '_' + str(FLAGS.year)+'.txt', 'path to BERT embeddings file')
+define_path('bert_embedding_path', lambda: 'data/programGeneratedData/bert_embeddings/BERT_base_'+str(FLAGS.da_type) + '_' + str(FLAGS.year)+'.txt', 'path to BERT embeddings file')
 tf.app.flags.DEFINE_string('temp_dir', 'data/programGeneratedData/temp/', 'directory for temporary files')
-tf.app.flags.DEFINE_string('temp_bert_dir', FLAGS.temp_dir+'bert/', 'directory for temporary BERT files')
+define_path('tensor_cache_dir', lambda: FLAGS.temp_dir+'tensors/', 'directory of the compiled train/test tensors of the LCR-Rot-hop++ model, keyed by data file, vocabulary and lengths (empty to disable)')
+define_path('temp_bert_dir', lambda: FLAGS.temp_dir+'bert/', 'directory for temporary BERT files')
+tf.app.flags.DEFINE_integer('bert_batch_size', 32, 'number of sentences per BERT forward pass when extracting embeddings')
+tf.app.flags.DEFINE_integer('bert_sort_pool', 50, 'number of batches that are sorted on length together, to limit padding')
+tf.app.flags.DEFINE_string('bert_embedding_format', 'text', 'format the BERT embeddings are written in: text (bert_embedding_path) or binary (the .npy/.vocab files read by utils.load_w2v_binary)')
+tf.app.flags.DEFINE_integer('bert_shards', 1, 'number of shards the BERT embedding extraction is split in, more than 1 runs the resumable sharded extraction')
+tf.app.flags.DEFINE_integer('bert_workers', 2, 'number of processes for the sharded BERT embedding extraction')
+define_path('bert_cache_file', lambda: FLAGS.temp_bert_dir+'embedding_cache.sqlite', 'sentence level BERT embedding cache shared by all DA types (empty to disable)')
 
 # locations for saving BERT finetuning data/external_data
-tf.app.flags.DEFINE_string('finetune_train_file', 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_' + str(FLAGS.year)+'_finetune_train.txt', 'file finetuning train data is written to')
-tf.app.flags.DEFINE_string('finetune_eval_file', 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_' + str(FLAGS.year)+'_finetune_eval.txt', 'file finetuning evaluation data is written to')
-tf.app.flags.DEFINE_string('finetune_model_dir', 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_finetune_model/', 'folder containing BERT model after finetuning')
+define_path('finetune_train_file', lambda: 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_' + str(FLAGS.year)+'_finetune_train.txt', 'file finetuning train data is written to')
+define_path('finetune_eval_file', lambda: 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_' + str(FLAGS.year)+'_finetune_eval.txt', 'file finetuning evaluation data is written to')
+define_path('finetune_model_dir', lambda: 'data/programGeneratedData/finetuning_data/' + FLAGS.da_type + '_finetune_model/', 'folder containing BERT model after finetuning')
 
 # Data augmentation vars
+define_path("parse_cache_file", lambda: FLAGS.temp_dir+'spacy_parses.spacy', "spaCy parses shared by all augmentation strategies (empty to keep them in memory only)")
+tf.app.flags.DEFINE_integer("parse_processes", 1, "number of processes spaCy parses the sentences to augment with")
+tf.app.flags.DEFINE_integer("aug_chunk_size", 64, "number of sentences whose masks are filled in one batched model call by the BERT augmentation modules")
 tf.app.flags.DEFINE_string("EDA_type", "original", "type of eda (original or adjusted)")
 tf.app.flags.DEFINE_integer("EDA_deletion", 1, "number of deletion augmentations")
 tf.app.flags.DEFINE_integer("EDA_replacement", 1, "number of replacement augmentations")
@@ -77,29 +119,54 @@ tf.app.flags.DEFINE_integer("EDA_swap", 1, "number of swap augmentations") # in
 tf.app.flags.DEFINE_float("EDA_pct", .2, "percentage of words affected by augmentation") # in adjusted mode EDA_swap not affected
 
 #svm traindata, svm testdata
-tf.app.flags.DEFINE_string("train_svm_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'trainsvmdata'+str(FLAGS.year)+".txt", "train data path")
-tf.app.flags.DEFINE_string("test_svm_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'testsvmdata'+str(FLAGS.year)+".txt", "formatted test data path")
-tf.app.flags.DEFINE_string("remaining_svm_test_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingsvmtestdata'+str(FLAGS.year)+".txt", "formatted remaining test data path after ontology")
+define_path("train_svm_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'trainsvmdata'+str(FLAGS.year)+".txt", "train data path")
+define_path("test_svm_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'testsvmdata'+str(FLAGS.year)+".txt", "formatted test data path")
+define_path("remaining_svm_test_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'remainingsvmtestdata'+str(FLAGS.year)+".txt", "formatted remaining test data path after ontology")
 
 #hyper traindata, hyper testdata
-tf.app.flags.DEFINE_string("hyper_train_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hypertraindata'+"_"+str(FLAGS.da_type)+str(FLAGS.year)+".txt", "hyper train data path")
-tf.app.flags.DEFINE_string("hyper_eval_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hyperevaldata'+"_"+str(FLAGS.da_type)+str(FLAGS.year)+".txt", "hyper eval data path")
+define_path("hyper_train_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hypertraindata'+"_"+str(FLAGS.da_type)+str(FLAGS.year)+".txt", "hyper train data path")
+define_path("hyper_eval_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hyperevaldata'+"_"+str(FLAGS.da_type)+str(FLAGS.year)+".txt", "hyper eval data path")
 
-tf.app.flags.DEFINE_string("hyper_svm_train_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hypertrainsvmdata'+str(FLAGS.year)+".txt", "hyper train svm data path")
-tf.app.flags.DEFINE_string("hyper_svm_eval_path", "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hyperevalsvmdata'+str(FLAGS.year)+".txt", "hyper eval svm data path")
+define_path("hyper_svm_train_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hypertrainsvmdata'+str(FLAGS.year)+".txt", "hyper train svm data path")
+define_path("hyper_svm_eval_path", lambda: "data/programGeneratedData/"+str(FLAGS.embedding_dim)+'hyperevalsvmdata'+str(FLAGS.year)+".txt", "hyper eval svm data path")
 
 #external data sources
-tf.app.flags.DEFINE_string("pretrain_file", "data/externalData/"+str(FLAGS.embedding_type)+"."+str(FLAGS.embedding_dim)+"d.txt", "pre-trained embedding vectors for non BERT and ELMo")
+define_path("pretrain_file", lambda: "data/externalData/"+str(FLAGS.embedding_type)+"."+str(FLAGS.embedding_dim)+"d.txt", "pre-trained embedding vectors for non BERT and ELMo")
 
-tf.app.flags.DEFINE_string("train_data", "data/externalData/restaurant_train_"+str(FLAGS.year)+".xml",
+define_path("train_data", lambda: "data/externalData/restaurant_train_"+str(FLAGS.year)+".xml",
                     "train data path")
-tf.app.flags.DEFINE_string("test_data", "data/externalData/restaurant_test_"+str(FLAGS.year)+".xml",
+define_path("test_data", lambda: "data/externalData/restaurant_test_"+str(FLAGS.year)+".xml",
                     "test data path")
 
+# ontology reasoner
+define_path('ontology_lemma_cache', lambda: FLAGS.temp_dir+'ontology_lemmas.pkl', '(word, POS tag) -> lemma table of the ontology reasoner, reused by later runs (empty to disable)')
+tf.app.flags.DEFINE_integer('ontology_lemma_cache_size', 100000, 'maximum number of lemmas kept in the ontology lemma table')
+tf.app.flags.DEFINE_boolean('ontology_precompute_closure', False, 'whether the ontology reasoner classifies all property x aspect classes of the test set with one reasoner call at the start')
+define_path('ontology_parse_cache', lambda: FLAGS.temp_dir+'ontology_dependency_parses.pkl', 'dependency parses used for negation detection by the ontology reasoner, reused by later runs (empty to disable)')
+define_path('ontology_snapshot', lambda: FLAGS.temp_dir+'ontology_snapshot.pkl', 'compiled ontology (lexicon index, class types, mentions and reasoner results), rebuilt when data/ontology.owl changes (empty to disable)')
+tf.app.flags.DEFINE_boolean('ontology_memoize', True, 'whether the ontology reasoner parses the negation sentences in one batch and reuses dependency parses and subsumptions within a run (disabled by the uncached mode of benchmark_ontology.py)')
+tf.app.flags.DEFINE_integer('ontology_workers', 1, 'number of processes the ontology reasoner classifies the sentences with')
+define_path('ontology_vocabulary', lambda: 'data/programGeneratedData/ontology_vocabulary_'+str(FLAGS.year)+'.npz', '(word, POS tag) -> ontology class and type of the corpus, built with ontology_vocabulary.py (empty to keep it in memory only)')
+define_path('ontology_filter_path', lambda: 'data/programGeneratedData/ontology_filter_'+str(FLAGS.year)+'.npz', 'ontology predictions and deferral mask of the test set, reused by main.py when shortCutOnt is set')
+
+# sweep over years and DA types (sweep.py)
+tf.app.flags.DEFINE_string('sweep_years', '2015,2016', 'comma separated years sweep.py runs')
+tf.app.flags.DEFINE_string('sweep_da_types', 'BERT-aspect,CBERT-aspect,BERT_prepend-aspect,BERT_expand-aspect,BERT-random,CBERT-random,BERT_prepend-random,BERT_expand-random', 'comma separated DA types sweep.py runs')
+tf.app.flags.DEFINE_string('sweep_stages', 'augment,bert_embedding,prepare_bert,remaining_idx', 'comma separated stages sweep.py runs for every year and DA type, in dependency order')
+tf.app.flags.DEFINE_integer('sweep_workers', 1, 'number of processes sweep.py runs (year, DA type) combinations in')
+
+# ontology reasoner benchmark (benchmark_ontology.py), over the years in sweep_years
+tf.app.flags.DEFINE_string('ontology_benchmark_modes', 'uncached,cold,warm', 'comma separated cache modes benchmark_ontology.py runs the ontology reasoner in, in this order')
+tf.app.flags.DEFINE_string('ontology_benchmark_file', 'results/ontology_benchmark.csv', 'CSV file the benchmark results are appended to (empty to only print them)')
+
 tf.app.flags.DEFINE_string('method', 'AE', 'model type: AE, AT or AEAT')
 tf.app.flags.DEFINE_string('prob_file', 'prob1.txt', 'prob')
 tf.app.flags.DEFINE_string('saver_file', 'prob1.txt', 'prob')
 
+# every flag is defined: parse the command line (other arguments are left to the scripts) and derive the paths
+FLAGS(sys.argv, known_only=True)
+derive_paths()
+
 
 def print_config():
     #FLAGS._parse_flags()
@@ -0,0 +1,8 @@
+from config import *
+from utils import convert_w2v_to_binary
+
+"""
+This file converts the BERT embedding text file of a data set into the binary format read by utils.load_w2v_binary.
+Running it is optional, lcrModelAlt_hierarchical_v4 converts the file on first use as well.
+"""
+convert_w2v_to_binary(FLAGS.bert_embedding_path, FLAGS.embedding_dim)
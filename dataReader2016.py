@@ -3,40 +3,49 @@ import json
 import xml.etree.ElementTree as ET
 from collections import Counter
 import string
-import en_core_web_sm
-n_nlp = en_core_web_sm.load()
 #import spacy
 import nltk
 import re
 import numpy as np
 
-def window(iterable, size): # stack overflow solution for sliding window
-    i = iter(iterable)
-    win = []
-    for e in range(0, size):
-        win.append(next(i))
-    yield win
-    for e in i:
-        win = win[1:] + [e]
-        yield win
-
-def _get_data_tuple(sptoks, asp_termIn, label):
-    # Find the ids of aspect term
-    aspect_is = []
+def locate_aspect(sptoks, asp_termIn):
+    """
+    Index of the first window of len(asp_termIn) tokens whose lower cased text contains the lower cased aspect term, None
+    if there is none. A window contains an occurrence of the term in the text of the whole sentence if it starts at or
+    before the occurrence and ends at or after it, so the sentence text is searched once instead of joining every window.
+    """
+    size = len(asp_termIn)
+    if size == 0 or size > len(sptoks):
+        return None
     asp_term = ' '.join(sp for sp in asp_termIn).lower()
-    for _i, group in enumerate(window(sptoks,len(asp_termIn))):
-        if asp_term == ' '.join([g.lower() for g in group]):
-            aspect_is = list(range(_i,_i+len(asp_termIn)))
-            break
-        elif asp_term in ' '.join([g.lower() for g in group]):
-            aspect_is = list(range(_i,_i+len(asp_termIn)))
-            break
+    lowered = [g.lower() for g in sptoks]
+    text = ' '.join(lowered)
+    lengths = np.array([len(g) for g in lowered])
+    starts = np.cumsum(lengths + 1) - lengths - 1  # character offset of every token in text
+    ends = starts + lengths
+    found = text.find(asp_term)
+    while found != -1:
+        first = int(np.searchsorted(starts, found, side='right')) - 1  # last window start at or before the occurrence
+        last = int(np.searchsorted(ends, found + len(asp_term)))  # first token ending at or after it
+        _i = max(0, last - size + 1)
+        if _i <= min(first, len(sptoks) - size):
+            return _i
+        found = text.find(asp_term, found + 1)
+    return None
 
 
-    print(aspect_is)
-    pos_info = []
-    for _i, sptok in enumerate(sptoks):
-        pos_info.append(min([abs(_i - i) for i in aspect_is]))
+def _get_data_tuple(sptoks, asp_termIn, label):
+    # Find the ids of aspect term
+    start = locate_aspect(sptoks, asp_termIn)
+    if start is None and len(sptoks) > 0:
+        raise ValueError("Aspect %s not found in: %s" % (' '.join(asp_termIn), ' '.join(sptoks)))
+
+    # distance of every token to the aspect term
+    if len(sptoks) > 0:
+        positions = np.arange(len(sptoks))
+        pos_info = np.maximum(np.maximum(start - positions, positions - (start + len(asp_termIn) - 1)), 0).tolist()
+    else:
+        pos_info = []
 
     lab = None
     if label == 'negative':
@@ -51,6 +60,20 @@ def _get_data_tuple(sptoks, asp_termIn, label):
     return pos_info, lab
 
 
+def iter_sentences(fname):
+    """
+    Streams the sentence elements of an XML file. Every sentence is cleared after it has been handled, together with the
+    elements read before it, so the tree is never held in memory.
+    """
+    context = ET.iterparse(fname, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'sentence':
+            yield elem
+            elem.clear()
+            root.clear()
+
+
 """
 This function reads data from the xml file
 
@@ -74,45 +97,62 @@ def read_data_2016(fname, source_count, source_word2idx, target_count, target_ph
     if os.path.isfile(fname) == False:
         raise ("[!] Data %s not found" % fname)
 
-    # parse xml file to tree
-    tree = ET.parse(fname)
-    root = tree.getroot()
-
-    outF= open(file_name, "w")
-
-    # save all words in source_words (includes duplicates)
-    # save all aspects in target_words (includes duplicates)
+    # count all words of the sentences and the aspects, and all aspect phrases, in order of first occurrence
     # finds max sentence length and max targets length
-    source_words, target_words, max_sent_len, max_target_len = [], [], 0, 0
-    target_phrases = []
+    source_words, target_words, max_sent_len, max_target_len = Counter(), Counter(), 0, 0
+    target_phrases = Counter()
+
+    # lower cased tokens of the sentences with aspects, and per aspect: its sentence, target phrase, location and label
+    sentence_tokens, aspects = [], []
 
     countConfl = 0
-    for sentence in root.iter('sentence'):
-        sent = sentence.find('text').text
-        sentenceNew = re.sub(' +', ' ', sent)
-        sptoks = nltk.word_tokenize(sentenceNew)
-        for sp in sptoks:
-            source_words.extend([''.join(sp).lower()])
-        if len(sptoks) > max_sent_len:
-            max_sent_len = len(sptoks)
-        for opinions in sentence.iter('Opinions'):
-            for opinion in opinions.findall('Opinion'):
-                if opinion.get("polarity") == "conflict":
-                    countConfl += 1
-                    continue
-                asp = opinion.get('target')
-                if asp != 'NULL':
+    # read the xml file in one pass, writing the aspects to the .txt file
+    with open(file_name, "w") as outF:
+        for sentence in iter_sentences(fname):
+            sent = sentence.find('text').text
+            sentenceNew = re.sub(' +', ' ', sent)
+            sptoks = nltk.word_tokenize(sentenceNew)
+            source_words.update(sp.lower() for sp in sptoks)
+            if len(sptoks) > max_sent_len:
+                max_sent_len = len(sptoks)
+            outputtext = ' '.join(sp for sp in sptoks).lower()
+            sentence_index = None
+            for opinions in sentence.iter('Opinions'):
+                for opinion in opinions.findall('Opinion'):
+                    if opinion.get("polarity") == "conflict":
+                        countConfl += 1
+                        continue
+                    asp = opinion.get('target')
+                    if asp == 'NULL': #removes implicit targets
+                        continue
                     aspNew = re.sub(' +', ' ', asp)
                     t_sptoks = nltk.word_tokenize(aspNew)
-                    for sp in t_sptoks:
-                        target_words.extend([''.join(sp).lower()])
-                    target_phrases.append(' '.join(sp for sp in t_sptoks).lower())
+                    target_words.update(sp.lower() for sp in t_sptoks)
+                    outputtarget = ' '.join(sp for sp in t_sptoks).lower()
+                    target_phrases[outputtarget] += 1
                     if len(t_sptoks) > max_target_len:
                         max_target_len = len(t_sptoks)
+                    if len(sptoks) == 0:
+                        continue
+                    outF.write(outputtext.replace(outputtarget, '$T$'))
+                    outF.write("\n")
+                    outF.write(outputtarget)
+                    outF.write("\n")
+                    pos_info, lab = _get_data_tuple(sptoks, t_sptoks, opinion.get('polarity'))
+                    pos_info = [(1-(i / len(sptoks))) for i in pos_info]
+                    outF.write(str(lab))
+                    outF.write("\n")
+                    if sentence_index is None:
+                        sentence_tokens.append(sptoks)
+                        sentence_index = len(sentence_tokens) - 1
+                    aspects.append((sentence_index, outputtarget, pos_info, lab))
+
     if len(source_count) == 0:
         source_count.append(['<pad>', 0])
-    source_count.extend(Counter(source_words + target_words).most_common())
-    target_count.extend(Counter(target_phrases).most_common())
+    # same order as Counter(sentence words + aspect words), so ties are ranked by first occurrence
+    source_words.update(target_words)
+    source_count.extend(source_words.most_common())
+    target_count.extend(target_phrases.most_common())
 
     for word, _ in source_count:
         if word not in source_word2idx:
@@ -122,50 +162,13 @@ def read_data_2016(fname, source_count, source_word2idx, target_count, target_ph
         if phrase not in target_phrase2idx:
             target_phrase2idx[phrase] = len(target_phrase2idx)
 
-    source_data, source_loc_data, target_data, target_label = list(), list(), list(), list()
-
-    category_list = []
-    # collect output data (match with source_word2idx) and write to .txt file
-    for sentence in root.iter('sentence'):
-        sent = sentence.find('text').text
-        sentenceNew = re.sub(' +', ' ', sent)
-        sptoks = nltk.word_tokenize(sentenceNew)
-        if len(sptoks) != 0:
-            idx = []
-            for sptok in sptoks:
-                idx.append(source_word2idx[''.join(sptok).lower()])
-            for opinions in sentence.iter('Opinions'):
-                for opinion in opinions.findall('Opinion'):
-                    if opinion.get("polarity") == "conflict": continue
-                    asp = opinion.get('target')
-                    if asp != 'NULL': #removes implicit targets
-                        aspNew = re.sub(' +', ' ', asp)
-                        t_sptoks = nltk.word_tokenize(aspNew)
-                        source_data.append(idx)
-                        outputtext = ' '.join(sp for sp in sptoks).lower()
-                        outputtarget = ' '.join(sp for sp in t_sptoks).lower()
-                        outputtext = outputtext.replace(outputtarget, '$T$')
-                        outF.write(outputtext)
-                        outF.write("\n")
-                        outF.write(outputtarget)
-                        outF.write("\n")
-                        pos_info, lab = _get_data_tuple(sptoks, t_sptoks, opinion.get('polarity'))
-                        pos_info = [(1-(i / len(idx))) for i in pos_info]
-                        source_loc_data.append(pos_info)
-                        targetdata = ' '.join(sp for sp in t_sptoks).lower()
-                        target_data.append(target_phrase2idx[targetdata])
-                        target_label.append(lab)
-                        outF.write(str(lab))
-                        outF.write("\n")
-
-                        category = opinion.get("category")
-                        category_list.append(category)
-
-    category_counts = Counter(category_list)
-    
-    outF.close()
+    # match the sentences with source_word2idx, once per sentence
+    sentence_idx = [[source_word2idx[sptok.lower()] for sptok in sptoks] for sptoks in sentence_tokens]
+    source_data = [sentence_idx[i] for i, _, _, _ in aspects]
+    source_loc_data = [pos_info for _, _, pos_info, _ in aspects]
+    target_data = [target_phrase2idx[targetdata] for _, targetdata, _, _ in aspects]
+    target_label = [lab for _, _, _, lab in aspects]
+
     print("Read %s aspects from %s" % (len(source_data), fname))
     print(f"Number of conflicting polarity: {countConfl}")
     return source_data, source_loc_data, target_data, target_label, max_sent_len, source_loc_data, max_target_len
-
-
@@ -362,6 +362,7 @@ def get_features(input_text, dim=768):
 upload = files.upload()  # raw2016forBERT
 
 # When it takes too long, data can be split in multiple subfiles as in- and output, by changing line 343,344,368
+# Outside Colab, rather run TorchBert.py with --bert_shards N, which splits the data itself and resumes after a crash
 lines = open('raw_data2016.txt', errors='replace').readlines()
 with open('BERT_base.txt', 'w') as f:
     for i in range(0 * 3, 2530 * 3, 3):  # len(lines)
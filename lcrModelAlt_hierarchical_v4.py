@@ -8,7 +8,7 @@ from sklearn.metrics import precision_score, recall_score, f1_score
 from nn_layer import softmax_layer, bi_dynamic_rnn, reduce_mean_with_len
 from att_layer import bilinear_attention_layer, dot_produce_attention_layer
 from config import *
-from utils import load_w2v, batch_index, load_inputs_twitter
+from utils import load_w2v_binary, batch_index, load_inputs_twitter_cached
 import numpy as np
 from tqdm import tqdm
 
@@ -93,7 +93,11 @@ def lcr_rot(input_fw, input_bw, sen_len_fw, sen_len_bw, target, sen_len_tr, keep
     prob = softmax_layer(outputs_fin, 8 * FLAGS.n_hidden, FLAGS.random_base, keep_prob2, l2, FLAGS.n_class)
     return prob, att_l, att_r, att_t_l, att_t_r
 
-def main(train_path, test_path, accuracyOnt, test_size, remaining_size, learning_rate=0.09, keep_prob=0.3, momentum=0.85, l2=0.00001, tuning=False):
+def main(train_path, test_path, accuracyOnt, test_size, remaining_size, learning_rate=0.09, keep_prob=0.3, momentum=0.85, l2=0.00001, tuning=False, test_mask=None):
+    '''
+    test_path: test data file, or its tensors as returned by load_inputs_twitter_cached (or load_inputs_twitter 'TC')
+    test_mask: boolean mask of the test instances to score (e.g. the deferral mask of OntReasoner.filter), None for all
+    '''
     
     # Load tuned hyperparameters if exists
     if tuning is False:
@@ -124,7 +128,7 @@ def main(train_path, test_path, accuracyOnt, test_size, remaining_size, learning
         
     print_config()    
     with tf.device('/GPU:0'):
-        word_id_mapping, w2v = load_w2v(FLAGS.bert_embedding_path, FLAGS.embedding_dim)
+        word_id_mapping, w2v = load_w2v_binary(FLAGS.bert_embedding_path, FLAGS.embedding_dim)
         word_embedding = tf.constant(w2v, name='word_embedding')
 
         keep_prob1 = tf.placeholder(tf.float32)
@@ -190,22 +194,30 @@ def main(train_path, test_path, accuracyOnt, test_size, remaining_size, learning
         else:
             is_r = False
 
-        tr_x, tr_sen_len, tr_x_bw, tr_sen_len_bw, tr_y, tr_target_word, tr_tar_len, _, _, _ = load_inputs_twitter(
+        tr_x, tr_sen_len, tr_x_bw, tr_sen_len_bw, tr_y, tr_target_word, tr_tar_len = load_inputs_twitter_cached(
             train_path,
             word_id_mapping,
             FLAGS.max_sentence_len,
-            'TC',
             is_r,
-            FLAGS.max_target_len
-        )
-        te_x, te_sen_len, te_x_bw, te_sen_len_bw, te_y, te_target_word, te_tar_len, _, _, _ = load_inputs_twitter(
-            test_path,
-            word_id_mapping,
-            FLAGS.max_sentence_len,
-            'TC',
-            is_r,
-            FLAGS.max_target_len
+            FLAGS.max_target_len,
+            FLAGS.tensor_cache_dir
         )
+        if type(test_path) is str:
+            test_data = load_inputs_twitter_cached(
+                test_path,
+                word_id_mapping,
+                FLAGS.max_sentence_len,
+                is_r,
+                FLAGS.max_target_len,
+                FLAGS.tensor_cache_dir
+            )
+        else:
+            test_data = test_path
+        te_x, te_sen_len, te_x_bw, te_sen_len_bw, te_y, te_target_word, te_tar_len = test_data[:7]
+        if test_mask is not None:
+            # only the rows the ontology deferred
+            te_x, te_sen_len, te_x_bw, te_sen_len_bw, te_y, te_target_word, te_tar_len = [
+                data[test_mask] for data in (te_x, te_sen_len, te_x_bw, te_sen_len_bw, te_y, te_target_word, te_tar_len)]
 
         def get_batch_data(x_f, sen_len_f, x_b, sen_len_b, yi, target, tl, batch_size, kp1, kp2, is_shuffle=True):
             for index in batch_index(len(yi), batch_size, 1, is_shuffle):
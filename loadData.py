@@ -1,10 +1,94 @@
 from dataReader2016 import read_data_2016
 from sklearn.model_selection import StratifiedKFold
+from concurrent.futures import ProcessPoolExecutor
+from utils import file_hash
+import multiprocessing
 import numpy as np
 import random
 import os
 import shutil
 
+def semeval_raw_file(xml_file, raw_dir):
+    return os.path.join(raw_dir, os.path.splitext(os.path.basename(xml_file))[0] + '.txt')
+
+def convert_xml_file(job):
+    """
+    Writes the raw text of the SemEval XML file to raw_file (sentence with $T$, target and polarity per aspect), unless
+    raw_file was made from this version of the XML file. The hash of the XML file is kept next to raw_file.
+    """
+    xml_file, raw_file = job
+    xml_hash = file_hash(xml_file)
+    hash_file = raw_file + '.sha1'
+    if os.path.isfile(raw_file) and os.path.isfile(hash_file):
+        with open(hash_file) as f:
+            if f.read().strip() == xml_hash:
+                return raw_file
+    os.makedirs(os.path.dirname(raw_file) or '.', exist_ok=True)
+    read_data_2016(xml_file, [], {}, [], {}, raw_file + '.tmp')
+    os.replace(raw_file + '.tmp', raw_file)
+    with open(hash_file, 'w') as f:
+        f.write(xml_hash)
+    return raw_file
+
+def convert_xml_files(xml_files, raw_dir, workers=1):
+    """
+    Converts SemEval XML files to raw text files in raw_dir, shared by all DA types, in a pool of worker processes.
+    XML files that did not change since their last conversion are not converted again.
+    :return: dictionary XML file -> raw file
+    """
+    jobs = [(xml_file, semeval_raw_file(xml_file, raw_dir)) for xml_file in dict.fromkeys(xml_files)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(workers, len(jobs)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            raw_files = list(pool.map(convert_xml_file, jobs))
+    else:
+        raw_files = [convert_xml_file(job) for job in jobs]
+    return dict((xml_file, raw_file) for (xml_file, _), raw_file in zip(jobs, raw_files))
+
+def da_options(da_type):
+    """
+    Splits a DA type like BERT_prepend-nouns in the arguments of loadDataAndEmbeddings:
+    use_eda, adjusted, use_bert, use_bert_prepend, use_bert_expand, use_c_bert and strategy
+    """
+    da_methods = da_type.split('-')
+    da_type = da_methods[0]
+    adjusted = False
+    if da_type == 'EDA':
+        use_eda = True
+        if len(da_methods) > 1:
+            if da_methods[1] == 'adjusted':
+                adjusted = True
+            else:
+                raise Exception('The EDA type used in FLAGS.da_type.split does not exist. Please correct flag value.')
+        else:
+            raise Exception('The EDA type to use is not specified. Please complete flag value.')
+    else:
+        use_eda = False
+
+    strategy = None
+    if len(da_methods) > 1:
+        strategy = da_methods[1]
+    
+    use_bert = False
+    if da_type == 'BERT':
+        use_bert = True
+
+    # determine whether bert-prepend should be used for DA
+    use_bert_prepend = False
+    if da_type == 'BERT_prepend':
+        use_bert_prepend = True
+        
+    # determine whether bert-expand should be used for DA
+    use_bert_expand = False
+    if da_type == 'BERT_expand':
+        use_bert_expand = True
+
+    # determine whether c-bert should be used for DA
+    use_c_bert = False
+    if da_type == 'CBERT':
+        use_c_bert = True
+
+    return use_eda, adjusted, use_bert, use_bert_prepend, use_bert_expand, use_c_bert, strategy
+
 def loadDataAndEmbeddings(config,loadData, use_eda, adjusted, use_bert, use_bert_prepend, use_bert_expand, use_c_bert,
                           strategy):
 
@@ -22,15 +106,11 @@ def loadDataAndEmbeddings(config,loadData, use_eda, adjusted, use_bert, use_bert
             # elif os.path.isfile(FLAGS.raw_data_file):
             # raise Exception('File '+FLAGS.raw_data_file+' already exists. Delete file and run again.')
             else:
-                # convert xml data to raw text data. If use_eda==True, also augment data
-                source_count, target_count = [], []
-                source_word2idx, target_phrase2idx = {}, {}
-                print('reading training data...')
-                train_data = read_data_2016(FLAGS.train_data, source_count, source_word2idx, target_count,
-                                            target_phrase2idx, FLAGS.train_path)
-                print('reading test data...')
-                test_data = read_data_2016(FLAGS.test_data, source_count, source_word2idx, target_count,
-                                           target_phrase2idx, FLAGS.test_path)
+                # convert xml data to raw text data, shared by all DA types, and copy it to the train and test paths
+                print('reading training and test data...')
+                raw_files = convert_xml_files([FLAGS.train_data, FLAGS.test_data], FLAGS.semeval_raw_dir, FLAGS.raw_workers)
+                shutil.copyfile(raw_files[FLAGS.train_data], FLAGS.train_path)
+                shutil.copyfile(raw_files[FLAGS.test_data], FLAGS.test_path)
         if FLAGS.do_create_augmentation_files:
             train_raw_path = FLAGS.train_path
             augment_path = FLAGS.augmentation_file_path
@@ -38,25 +118,25 @@ def loadDataAndEmbeddings(config,loadData, use_eda, adjusted, use_bert, use_bert
             if use_bert:
                 import BERTaug
                 BERTaug.file_maker(train_raw_path, augment_path,
-                                            strategy)
+                                            strategy, FLAGS.aug_chunk_size, FLAGS.parse_cache_file, FLAGS.parse_processes)
 
             # if BERT-prepend is used for DA, create new sentences using BERT-prepend
             if use_bert_prepend:
                 import BERTprepend_aug
                 BERTprepend_aug.file_maker(train_raw_path, augment_path,
-                                                           strategy)
+                                                           strategy, FLAGS.aug_chunk_size, FLAGS.parse_cache_file, FLAGS.parse_processes)
             
             # if BERT-expand is used for DA, create new sentences using BERT-expand
             if use_bert_expand:
                 import BERTexpand_aug
                 BERTexpand_aug.file_maker(train_raw_path, augment_path,
-                                                           strategy)
+                                                           strategy, FLAGS.aug_chunk_size, FLAGS.parse_cache_file, FLAGS.parse_processes)
 
             # if C-BERT is used for DA, create new sentences using BERT-prepend
             if use_c_bert:
                 import CBERTaug
                 CBERTaug.file_maker(train_raw_path, augment_path,
-                                                               strategy)
+                                                               strategy, FLAGS.aug_chunk_size, FLAGS.parse_cache_file, FLAGS.parse_processes)
 
             # if EDA is used for DA, create new sentences using EDA
             if use_eda:
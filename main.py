@@ -4,7 +4,7 @@
 # https://github.com/NUSTM/ABSC
 
 import tensorflow.compat.v1 as tf
-from OntologyReasoner import OntReasoner
+from OntologyReasoner import OntReasoner, ontology_accuracy
 from loadData import *
 
 #import parameter configuration and data paths
@@ -12,6 +12,7 @@ from config import *
 
 #import modules
 import numpy as np
+import os
 import sys
 
 import lcrModelAlt_hierarchical_v4
@@ -21,8 +22,13 @@ def main(_):
     loadData         = False        # Only True for making data augmentations or raw_data files
                                     # Use TorchBert in Google Colab to generate the BERT embeddings for every word
                                     # Use prepare_bert for making train and test data sets
-    useOntology      = False        # When run together with runLCRROTALT, the two-step method is used
-    shortCutOnt      = True         # Only possible when last run was for same year of training/testing data
+    useOntology      = False        # Runs the ontology reasoner and saves its predictions. Together with runLCRROTALT_v4 the run
+                                    # goes on with the two-step method (LCR-Rot-hop++ scores the deferred instances),
+                                    # set runLCRROTALT_v4 = False to stop after the ontology
+                                    # --ontology_workers N classifies the sentences in N processes
+                                    # --ontology_precompute_closure reasons about all property x aspect classes in one reasoner call
+    shortCutOnt      = True         # Reuses the ontology predictions saved by the last ontology run (useOntology) for this year,
+                                    # or the remaining test data and stored ontology results if there are none
 
     runSVM           = False
 
@@ -34,43 +40,7 @@ def main(_):
     else:
         backup = False
 
-    da_methods = FLAGS.da_type.split('-')
-    da_type = da_methods[0]
-    adjusted = False
-    if da_type == 'EDA':
-        use_eda = True
-        if len(da_methods) > 1:
-            if da_methods[1] == 'adjusted':
-                adjusted = True
-            else:
-                raise Exception('The EDA type used in FLAGS.da_type.split does not exist. Please correct flag value.')
-        else:
-            raise Exception('The EDA type to use is not specified. Please complete flag value.')
-    else:
-        use_eda = False
-
-    strategy = None
-    if len(da_methods) > 1:
-        strategy = da_methods[1]
-    
-    use_bert = False
-    if da_type == 'BERT':
-        use_bert = True
-
-    # determine whether bert-prepend should be used for DA
-    use_bert_prepend = False
-    if da_type == 'BERT_prepend':
-        use_bert_prepend = True
-        
-    # determine whether bert-expand should be used for DA
-    use_bert_expand = False
-    if da_type == 'BERT_expand':
-        use_bert_expand = True
-
-    # determine whether c-bert should be used for DA
-    use_c_bert = False
-    if da_type == 'CBERT':
-        use_c_bert = True
+    use_eda, adjusted, use_bert, use_bert_prepend, use_bert_expand, use_c_bert, strategy = da_options(FLAGS.da_type)
 
     # retrieve data and wordembeddings
     train_size, test_size, train_polarity_vector, test_polarity_vector = loadDataAndEmbeddings(FLAGS, loadData, use_eda, adjusted, 
@@ -80,38 +50,40 @@ def main(_):
         return 0
     
     print(test_size)
-    remaining_size = 250
-    accuracyOnt = 0.87
-
-    if useOntology == True:
-        print('Starting Ontology Reasoner')
-        #in sample accuracy
-        Ontology = OntReasoner()
-        accuracyOnt, remaining_size = Ontology.run(backup,FLAGS.test_path_ont, runSVM)
-        #out of sample accuracy
-        #Ontology = OntReasoner()      
-        #accuracyInSampleOnt, remainingInSample_size = Ontology.run(backup,FLAGS.train_path_ont, runSVM)        
-        if runSVM == True:
-            test = FLAGS.remaining_svm_test_path
+    test = FLAGS.test_path
+    test_mask = None # test instances scored by the backup method, None for all
+    remaining_size = test_size
+    accuracyOnt = 0.
+
+    if useOntology == True or (shortCutOnt == True and os.path.isfile(FLAGS.ontology_filter_path)):
+        if useOntology == True:
+            print('Starting Ontology Reasoner')
+            Ontology = OntReasoner()
+            predictions, deferred = Ontology.filter(*Ontology.read_data(FLAGS.test_path_ont), use_backup=backup)
+            polarity_vector = Ontology.polarity_vector
+            np.savez(FLAGS.ontology_filter_path, predictions=predictions, deferred=deferred, polarity_vector=polarity_vector)
         else:
+            saved = np.load(FLAGS.ontology_filter_path)
+            predictions, deferred, polarity_vector = saved['predictions'], saved['deferred'], saved['polarity_vector']
+        accuracyOnt = ontology_accuracy(predictions, deferred, polarity_vector)
+        remaining_size = int(deferred.sum())
+        print('test acc={:.4f}, remaining size={}'.format(accuracyOnt, remaining_size))
+        if not backup:
+            return 0
+        test_mask = deferred
+    elif shortCutOnt == True:
+        # no saved predictions: the remaining test data and results of the last ontology run for this year
+        print('No saved ontology predictions at ' + FLAGS.ontology_filter_path + ', using ' + FLAGS.remaining_test_path)
+        #2015
+        if FLAGS.year == 2015:
+            accuracyOnt = 0.8277
+            remaining_size = 301
+            test = FLAGS.remaining_test_path
+        #2016
+        if FLAGS.year == 2016:
+            accuracyOnt = 0.8682
+            remaining_size = 248
             test = FLAGS.remaining_test_path
-            print(test[0])
-        print('train acc = {:.4f}, test acc={:.4f}, remaining size={}'.format(accuracyOnt, accuracyOnt, remaining_size))
-        return 0
-    else:
-        if shortCutOnt == True:
-            #2015
-            if FLAGS.year == 2015:
-                accuracyOnt = 0.8277
-                remaining_size = 301
-                test = FLAGS.remaining_test_path
-            #2016
-            if FLAGS.year == 2016:
-                accuracyOnt = 0.8682
-                remaining_size = 248
-                test = FLAGS.remaining_test_path
-        else:
-            test = FLAGS.test_path
 
     # LCR-Rot-hop model
    # if runLCRROTALT == True:
@@ -121,7 +93,7 @@ def main(_):
 
     if runLCRROTALT_v4 == True:
        _, pred2, fw2, bw2, tl2, tr2 = lcrModelAlt_hierarchical_v4.main(FLAGS.train_path, test, accuracyOnt, test_size,
-                                                        remaining_size)
+                                                        remaining_size, test_mask=test_mask)
        tf.reset_default_graph()
 
 '''
@@ -0,0 +1,159 @@
+'''
+Batched [MASK] filling for the BERT augmentation modules (BERTaug, CBERTaug, BERTexpand_aug, BERTprepend_aug).
+
+An augmentation function is written as a generator: it adds every single-mask variant of its sentence to a MaskBatch,
+puts a MaskSlot in the augmented sentence where the prediction goes, yields the batch and, once resumed, resolves the
+slots into words. run_augmentations fills the masks of any number of sentences with one batched model call.
+'''
+import functools
+import torch
+import torch.nn.functional as F
+
+
+class MaskSlot(object):
+    """Place of one masked word in an augmented sentence, filled once its batch is predicted."""
+    def __init__(self, batch, index, masked_word):
+        self.batch = batch
+        self.index = index
+        self.masked_word = masked_word
+
+    @property
+    def value(self):
+        predicted_words = self.batch.predictions[self.index]
+        if not predicted_words: # the mask was truncated away, keep the original word
+            return self.masked_word
+        if predicted_words[0] == self.masked_word: # skip to the next predicted word
+            return predicted_words[1]
+        return predicted_words[0]
+
+
+class MaskBatch(object):
+    """
+    Single-mask variants of one sentence.
+    :param fill: function (texts, contexts) -> two predicted words per text, e.g. a module's unmasker_batch
+    :param context: passed to fill with every text of this batch (the sentiment for the conditional models)
+    """
+    def __init__(self, fill, context=None):
+        self.fill = fill
+        self.context = context
+        self.texts = []
+        self.predictions = None
+
+    def add(self, text, masked_word):
+        self.texts.append(text)
+        return MaskSlot(self, len(self.texts) - 1, masked_word)
+
+
+def resolve(value):
+    """Replaces the MaskSlots in a word or list of words by their predicted words."""
+    if isinstance(value, MaskSlot):
+        return value.value
+    if isinstance(value, list):
+        return [resolve(v) for v in value]
+    return value
+
+
+def run_augmentations(generators):
+    """
+    Runs augmentation generators up to their yielded MaskBatch, fills the masks of all of them with one call per fill
+    function and resumes them. Returns their results in order.
+    """
+    results = [None] * len(generators)
+    pending = []
+    for k, gen in enumerate(generators):
+        try:
+            pending.append((k, gen, next(gen)))
+        except StopIteration as stop: # nothing to mask
+            results[k] = stop.value
+
+    fills = []
+    for _, _, batch in pending:
+        if batch.fill not in fills:
+            fills.append(batch.fill)
+    for fill in fills:
+        batches = [batch for _, _, batch in pending if batch.fill is fill]
+        texts, contexts = [], []
+        for batch in batches:
+            texts.extend(batch.texts)
+            contexts.extend([batch.context] * len(batch.texts))
+        predictions = fill(texts, contexts) if texts else []
+        offset = 0
+        for batch in batches:
+            batch.predictions = predictions[offset:offset + len(batch.texts)]
+            offset += len(batch.texts)
+
+    for k, gen, batch in pending:
+        try:
+            gen.send(None)
+        except StopIteration as stop:
+            results[k] = stop.value
+        else:
+            raise RuntimeError('Augmentation function yielded more than one MaskBatch')
+    return results
+
+
+def mask_batched(gen_func):
+    """
+    Makes an augmentation generator callable like a plain augmentation function. The generator itself stays
+    available as .steps, for filling the masks of many sentences at once with run_augmentations.
+    """
+    @functools.wraps(gen_func)
+    def augment(*args):
+        return run_augmentations([gen_func(*args)])[0]
+    augment.steps = gen_func
+    return augment
+
+
+def augment_lines(lines, steps, chunk_size, with_sentiment=True):
+    """
+    Augments a raw data file (sentence, target and sentiment lines) chunk by chunk: the augmentation generators of a chunk
+    parse their sentence and select the words to mask, the masks of the whole chunk are filled with one batched model
+    call and the augmented sentences are reassembled in input order.
+    :param steps: generator function of an augmentation function, e.g. augment_random.steps
+    :param with_sentiment: whether steps takes the sentiment as third argument
+    :return: generator of (sentence, target, sentiment, new sentence, new target), one per instance
+    """
+    instances = [(lines[i].strip(), lines[i + 1].strip(), lines[i + 2].strip()) for i in range(0, len(lines) - 1, 3)]
+    for start in range(0, len(instances), chunk_size):
+        chunk = instances[start:start + chunk_size]
+        if with_sentiment:
+            generators = [steps(sentence, target, sentiment) for sentence, target, sentiment in chunk]
+        else:
+            generators = [steps(sentence, target) for sentence, target, _ in chunk]
+        for instance, (new_sentence, new_target) in zip(chunk, run_augmentations(generators)):
+            yield instance + (new_sentence, new_target)
+
+
+def fill_mask_ids(model, tokenizer, texts, token_type_ids=None, sample=True, batch_size=64, max_length=100):
+    """
+    Predicts two candidate token ids for the [MASK] in every text, running batch_size texts per forward pass.
+    With sample the two ids are drawn from the softmax of the [MASK] logits, otherwise the two most likely are taken.
+    :param token_type_ids: one segment id per text, used for every token of that text (CBERT label embedding)
+    :return: list with two token ids per text, empty when the [MASK] was truncated away
+    """
+    mask_id = tokenizer.convert_tokens_to_ids(['[MASK]'])[0]
+    model.eval()
+    all_ids = []
+    for start in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[start:start + batch_size], return_tensors='pt', max_length=max_length, padding=True,
+                           truncation=True, add_special_tokens=True)
+        input_ids = inputs['input_ids'].long()
+        model_inputs = {'input_ids': input_ids,
+                        'attention_mask': inputs['attention_mask'].long()}
+        if token_type_ids is not None:
+            labels = torch.tensor(token_type_ids[start:start + batch_size]).long()
+            model_inputs['token_type_ids'] = labels.unsqueeze(1).expand_as(input_ids).contiguous()
+        with torch.no_grad():
+            logits = model(**model_inputs)[0]
+        for row in range(input_ids.size(0)):
+            masked_idx = (input_ids[row] == mask_id).nonzero(as_tuple=True)[0].tolist()
+            if not masked_idx:
+                all_ids.append([])
+                continue
+            pred_probs = F.softmax(logits[row, masked_idx[-1]], dim=-1)
+            if sample:
+                pred = torch.multinomial(pred_probs, 2) # obtain the first two predictions
+            else:
+                pred = torch.topk(pred_probs, 2).indices
+            all_ids.append([t.item() for t in pred])
+    return all_ids
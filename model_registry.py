@@ -0,0 +1,63 @@
+'''
+Process-wide registry of the models used by the augmentation modules (BERTaug, CBERTaug, BERTexpand_aug,
+BERTprepend_aug). Models are loaded the first time they are used instead of at import time, and every strategy and
+module in the process shares the loaded instance.
+'''
+import threading
+
+_models = {}
+_lock = threading.RLock()
+
+
+def get(name, loader):
+    """Returns the model registered under name, loading it with loader() on first use."""
+    with _lock:
+        if name not in _models:
+            _models[name] = loader()
+        return _models[name]
+
+
+def release(name=None):
+    """Drops one model (or all models) from the registry, so it is loaded again on next use."""
+    with _lock:
+        if name is None:
+            _models.clear()
+        else:
+            _models.pop(name, None)
+
+
+class LazyModel(object):
+    """Stand-in for a registered model that loads it on first attribute access or call."""
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+
+    def load(self):
+        return get(self._name, self._loader)
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+
+def lazy(name, loader):
+    return LazyModel(name, loader)
+
+
+def load_spacy():
+    import spacy
+    return spacy.load('en_core_web_sm')
+
+
+# spaCy English model, shared by all augmentation modules
+nlp = lazy('en_core_web_sm', load_spacy)
+
+
+def parse_cache(path=None, n_process=1):
+    """Shared spaCy parse cache of the DocBin file at path (in memory only if path is empty)."""
+    from parse_cache import ParseCache
+    cache = get('parse_cache:' + (path or ''), lambda: ParseCache(nlp, path))
+    cache.n_process = n_process
+    return cache
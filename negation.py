@@ -0,0 +1,94 @@
+'''
+Negation detection for the ontology reasoner (OntologyReasoner.is_negated): dependency parses of the sentences, each
+parsed at most once and kept on disk between runs and cross-validation folds.
+'''
+import os
+import pickle
+
+# a sentence containing any of these is checked with the dependency parser
+NEGATION_CUES = ["not", "n,t", "never"]
+
+
+def has_negation_cue(words_in_sentence):
+    return any(x in s for x in NEGATION_CUES for s in words_in_sentence)
+
+
+class DependencyParseCache():
+    """
+    Dependency triples per sentence, parsed with an nltk Stanford dependency parser.
+    :param dependency_parser: e.g. nltk.parse.stanford.StanfordDependencyParser
+    :param path: pickle file the triples are read from and saved to (None to keep them in memory only)
+    :param memoize: whether parses are kept at all; if False every call of triples runs the parser
+    """
+    def __init__(self, dependency_parser, path=None, memoize=True):
+        self.dependency_parser = dependency_parser
+        self.path = path
+        self.memoize = memoize
+        self.parses = {}
+        self.changed = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.parses = pickle.load(f)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                print('Could not read dependency parse cache ' + path + ', starting with an empty one')
+
+    def triples(self, sentence):
+        """Dependency triples ((head, tag), relation, (dependent, tag)) of the first parse of sentence."""
+        if sentence not in self.parses:
+            print('negation parser')
+            print(sentence)
+            dep = self.dependency_parser.raw_parse(sentence).__next__()
+            if not self.memoize:
+                return list(dep.triples())
+            self.parses[sentence] = list(dep.triples())
+            self.changed = True
+        return self.parses[sentence]
+
+    def parse_all(self, sentences):
+        """
+        Parses all sentences that are not cached yet with a single parser process, instead of starting the parser
+        for every sentence.
+        """
+        missing = [s for s in dict.fromkeys(sentences) if s not in self.parses]
+        if not missing or not self.memoize:
+            return
+        print('negation parser: parsing %d sentences' % len(missing))
+        for sentence, parses in zip(missing, self.dependency_parser.raw_parse_sents(missing)):
+            self.parses[sentence] = list(next(iter(parses)).triples())
+        self.changed = True
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(self.parses, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.changed = False
+
+
+def is_negated(word, words_in_sentence, parse_cache):
+    """
+    Whether word is negated: a negation in the three words before it, or else a 'neg' dependency on it in the parse of
+    the sentence.
+    """
+    index = words_in_sentence.index(word)
+    negated = False
+
+    if index < 3:
+        for i in range(index):
+            temp = words_in_sentence[i]
+            if "not" in temp or "n't" in temp or "never" in temp:
+                negated = True
+    else:
+        for i in range(index - 3, index):
+            temp = words_in_sentence[i]
+            if "not" in temp or "n't" in temp or "never" in temp:
+                negated = True
+    if negated == False and has_negation_cue(words_in_sentence):
+        for triple in parse_cache.triples(' '.join(words_in_sentence)):
+            if triple[0][0] == word and triple [1] == 'neg':
+                negated = True
+                break
+    return negated
@@ -0,0 +1,129 @@
+'''
+Compiled form of the domain ontology for the ontology reasoner (OntologyReasoner.py). Everything the reasoner needs
+per sentence is taken from the OWL file once and saved, keyed by the hash of the OWL file, so later runs and
+cross-validation folds neither load the ontology with owlready2 nor walk its classes again. Classes are referred to
+by name.
+
+The snapshot is saved at --ontology_snapshot; --ontology_snapshot '' compiles the ontology on every run instead.
+'''
+import hashlib
+import os
+import pickle
+
+SNAPSHOT_VERSION = 1
+
+
+def owl_hash(owl_file):
+    sha = hashlib.sha1()
+    with open(owl_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def check_subclass(parent_class, onto_class):
+    """Whether onto_class is a subclass of parent_class, None if the check is not possible."""
+    try:
+        return parent_class.__subclasscheck__(onto_class)
+    except AttributeError:
+        return None
+
+
+def create_types(onto):
+    """
+    Lower case names of the generic sentiment classes (type 1), the aspect specific sentiment classes (type 2) and the
+    property mentions whose sentiment depends on the aspect (type 3).
+    """
+    types1 = set()
+    types2 = set()
+    types3 = set()
+
+    classes = list(onto.classes())
+
+    for c in classes:
+        name_class = c.__name__
+        remove_words = ['Property', "Mention", "Positive", "Neutral", "Negative"]
+        if any(word in name_class for word in remove_words):
+            continue
+        ancestors = c.ancestors()
+        boolean = 1
+        ancestors_list = []
+        for an in ancestors:
+            name_an = an.__name__
+            ancestors_list.append(name_an)
+        ancestors_list.sort()
+
+        for name_ancestor in ancestors_list:
+            if boolean == 1:
+                if "Generic" in name_ancestor:
+                    types1.add(name_class.lower())
+                    boolean = 0
+                elif "Positive" in name_ancestor or "Negative" in name_ancestor:
+                    types2.add(name_class.lower())
+                    boolean = 0
+                elif "PropertyMention" in name_ancestor:
+                    types3.add(name_class.lower())
+                    boolean = 0
+    return types1, types2, types3
+
+
+class OntologySnapshot():
+    """
+    lex_index: lemma -> name of the class with that lemma in its lex
+    types1, types2, types3: see create_types
+    ancestors: class name -> names of its ancestors
+    mentions: class name -> its ancestors with 'Mention' in their name, without the 'Mention' suffix
+    positive, negative: class name -> whether it is a subclass of Positive / Negative (None if not checkable)
+    subsumptions: (property class, target class) -> (positive, negative) after reasoning, filled by the reasoner
+    """
+    def __init__(self, owl_hash):
+        self.version = SNAPSHOT_VERSION
+        self.owl_hash = owl_hash
+        self.lex_index = {}
+        self.types1, self.types2, self.types3 = set(), set(), set()
+        self.ancestors = {}
+        self.mentions = {}
+        self.positive = {}
+        self.negative = {}
+        self.subsumptions = {}
+
+
+def compile_snapshot(onto, owl_hash):
+    snapshot = OntologySnapshot(owl_hash)
+    positive_class = onto.search(iri='*Positive')[0]
+    negative_class = onto.search(iri='*Negative')[0]
+    for onto_class in onto.classes():
+        name = onto_class.__name__
+        # the first class with the lemma in its lex wins
+        for lemma in onto_class.lex:
+            snapshot.lex_index.setdefault(lemma, name)
+        ancestor_names = set(an.__name__ for an in onto_class.ancestors())
+        snapshot.ancestors[name] = ancestor_names
+        snapshot.mentions[name] = set(an.rsplit('Mention', 1)[0] for an in ancestor_names if "Mention" in an)
+        snapshot.positive[name] = check_subclass(positive_class, onto_class)
+        snapshot.negative[name] = check_subclass(negative_class, onto_class)
+    snapshot.types1, snapshot.types2, snapshot.types3 = create_types(onto)
+    return snapshot
+
+
+def load_snapshot(path, owl_hash):
+    """The snapshot saved at path, or None if there is none for this version of the OWL file."""
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError):
+        return None
+    if getattr(snapshot, 'version', None) != SNAPSHOT_VERSION or snapshot.owl_hash != owl_hash:
+        return None
+    return snapshot
+
+
+def save_snapshot(snapshot, path):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,109 @@
+'''
+Ontology class and type of every (word, POS tag) of the corpus, labelled once offline and stored as arrays next to the
+training data. The ontology reasoner (OntologyReasoner.py) then finds the class and type of a word with a lookup instead
+of lemmatising the word and looking the lemma up in the lexicon. The POS tag is part of the key because the lemma of a
+word depends on it.
+
+Build it with: python ontology_vocabulary.py --year 2016
+'''
+import os
+import numpy as np
+
+# type bits of a token: its lemma names a generic sentiment class (type 1), an aspect specific sentiment class (type 2)
+# or a property mention (type 3), see ontology_snapshot.create_types
+TYPE1, TYPE2, TYPE3 = 1, 2, 4
+NO_CLASS = -1
+
+
+def lemma_types(lemma, types1, types2, types3):
+    return (TYPE1 if lemma in types1 else 0) | (TYPE2 if lemma in types2 else 0) | (TYPE3 if lemma in types3 else 0)
+
+
+class OntologyVocabulary():
+    """
+    token_ids: (word, POS tag) -> row of class_ids and type_bits
+    class_ids: index in class_names of the ontology class of the token, NO_CLASS if it has none
+    type_bits: TYPE1 | TYPE2 | TYPE3 bits of the token
+    unseen: (word, POS tag) -> (class name, type bits) of tokens labelled after loading, added to the arrays on save
+    """
+    def __init__(self, owl_hash):
+        self.owl_hash = owl_hash
+        self.token_ids = {}
+        self.class_names = []
+        self.class_index = {}
+        self.class_ids = np.zeros(0, dtype=np.int32)
+        self.type_bits = np.zeros(0, dtype=np.uint8)
+        self.unseen = {}
+
+    def class_id(self, class_name):
+        if class_name is None:
+            return NO_CLASS
+        if class_name not in self.class_index:
+            self.class_index[class_name] = len(self.class_names)
+            self.class_names.append(class_name)
+        return self.class_index[class_name]
+
+    def get(self, word, tag, label):
+        """(class name or None, type bits) of the token, labelled with label(word, tag) if it is not in the vocabulary."""
+        row = self.token_ids.get((word, tag))
+        if row is not None:
+            class_id = self.class_ids[row]
+            return (self.class_names[class_id] if class_id != NO_CLASS else None), int(self.type_bits[row])
+        if (word, tag) not in self.unseen:
+            self.unseen[(word, tag)] = label(word, tag)
+        return self.unseen[(word, tag)]
+
+    def add(self, tokens, label):
+        """Labels the (word, POS tag) tokens that are not in the vocabulary yet with label(word, tag) and stores them."""
+        new = [token for token in dict.fromkeys(tokens) if token not in self.token_ids]
+        if not new:
+            return
+        labels = [self.unseen.pop(token) if token in self.unseen else label(*token) for token in new]
+        for token in new:
+            self.token_ids[token] = len(self.token_ids)
+        self.class_ids = np.concatenate([self.class_ids, np.array([self.class_id(c) for c, _ in labels], dtype=np.int32)])
+        self.type_bits = np.concatenate([self.type_bits, np.array([bits for _, bits in labels], dtype=np.uint8)])
+
+    def save(self, path):
+        self.add(list(self.unseen), None)
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tokens = list(self.token_ids)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, words=np.array([word for word, _ in tokens], dtype=str), tags=np.array([tag for _, tag in tokens], dtype=str),
+                     class_ids=self.class_ids, type_bits=self.type_bits, class_names=np.array(self.class_names, dtype=str),
+                     owl_hash=np.array(self.owl_hash))
+        os.replace(path + '.tmp', path)
+
+
+def load_vocabulary(path, owl_hash):
+    """The vocabulary saved at path, or None if there is none for this version of the OWL file."""
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if str(data['owl_hash']) != owl_hash:
+                return None
+            vocabulary = OntologyVocabulary(owl_hash)
+            vocabulary.token_ids = dict((token, row) for row, token in enumerate(zip(data['words'].tolist(), data['tags'].tolist())))
+            vocabulary.class_names = data['class_names'].tolist()
+            vocabulary.class_ids = data['class_ids']
+            vocabulary.type_bits = data['type_bits']
+    except (IOError, ValueError, KeyError):
+        return None
+    vocabulary.class_index = dict((name, i) for i, name in enumerate(vocabulary.class_names))
+    return vocabulary
+
+
+def main():
+    from config import FLAGS
+    from OntologyReasoner import OntReasoner
+    reasoner = OntReasoner()
+    reasoner.build_vocabulary([FLAGS.train_path_ont, FLAGS.test_path_ont])
+    print('%d tokens in the ontology vocabulary, %d with a class' % (len(reasoner.vocabulary.token_ids),
+                                                                     int((reasoner.vocabulary.class_ids != NO_CLASS).sum())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+spaCy parse cache for the augmentation modules (BERTaug, CBERTaug, BERTexpand_aug, BERTprepend_aug).
+
+The same training file is augmented with every strategy of every model family, so the same sentences and targets are
+parsed over and over. ParseCache keeps the parses by text, fills itself with nlp.pipe and stores them as a DocBin, so
+later runs only parse sentences they have not seen before.
+'''
+import os
+from spacy.tokens import DocBin
+
+# token attributes the augmentation functions use (text and part of speech) plus what is needed to rebuild the text
+PARSE_ATTRS = ["ORTH", "SPACY", "TAG", "POS", "LEMMA"]
+
+
+class ParseCache(object):
+    """
+    Parses texts with nlp, at most once per text.
+    :param nlp: loaded spaCy pipeline
+    :param path: DocBin file the parses are read from and saved to, None to keep them in memory only. The spaCy model
+    name and version are added to the file name, so parses of another model are never reused.
+    """
+    def __init__(self, nlp, path=None, batch_size=256, n_process=1):
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.docs = {}
+        self.path = None
+        self.changed = False
+        if path:
+            root, ext = os.path.splitext(path)
+            self.path = '%s_%s-%s%s' % (root, nlp.meta['name'], nlp.meta['version'], ext or '.spacy')
+            if os.path.isfile(self.path):
+                doc_bin = DocBin(attrs=PARSE_ATTRS).from_disk(self.path)
+                for doc in doc_bin.get_docs(nlp.vocab):
+                    self.docs[doc.text] = doc
+
+    def __call__(self, text):
+        doc = self.docs.get(text)
+        if doc is None:
+            doc = self.nlp(text)
+            self.docs[text] = doc
+            self.changed = True
+        return doc
+
+    def prime(self, texts):
+        """Parses all texts that are not cached yet in batches with nlp.pipe."""
+        missing = list(dict.fromkeys(text for text in texts if text not in self.docs))
+        if not missing:
+            return
+        for text, doc in zip(missing, self.nlp.pipe(missing, batch_size=self.batch_size, n_process=self.n_process)):
+            self.docs[text] = doc
+        self.changed = True
+
+    def save(self):
+        """Writes the parses to the DocBin file, if there is one and something new was parsed."""
+        if self.path is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        doc_bin = DocBin(attrs=PARSE_ATTRS, docs=self.docs.values())
+        tmp_path = self.path + '.tmp'
+        doc_bin.to_disk(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.changed = False
@@ -1,5 +1,6 @@
 #!/bin/bash
 
+# Same sweep in one Python process: python sweep.py --sweep_stages prepare_bert
 years=(2015 2016)
 
 # List of DA types
@@ -3,17 +3,46 @@ import numpy as np
 
 """
 This file is used to construct remaining test cases for LCR-rot-hop++ for each augmented data set.
+Run as a script it extracts them for every year in --sweep_years and every DA type in --sweep_da_types in one go.
 """
-# Parse the content into a list of floats
-remaining_pos_vector = np.load(f"remaining_test_indices_{FLAGS.year}.npy")
-
-outF= open(FLAGS.remaining_test_path, "w")
-print(FLAGS.test_path)
-try:
-    with open(FLAGS.test_path, "r") as fd:
-        for i, line in enumerate(fd):
-            if i in remaining_pos_vector:
-                outF.write(line)
-    outF.close()
-except Exception as e:
-    print(e)
\ No newline at end of file
+def load_remaining_positions(year):
+    # line numbers of the test instances the ontology could not classify
+    return np.load(f"remaining_test_indices_{year}.npy").astype(np.int64)
+
+
+def extract_remaining(test_path, remaining_test_path, remaining_pos_vector):
+    """Writes the lines of test_path at the remaining positions to remaining_test_path."""
+    with open(test_path, "r") as fd:
+        lines = fd.readlines()
+    keep = np.zeros(len(lines), dtype=bool)
+    keep[remaining_pos_vector[(remaining_pos_vector >= 0) & (remaining_pos_vector < len(lines))]] = True
+    with open(remaining_test_path, "w") as outF:
+        outF.writelines([lines[i] for i in np.flatnonzero(keep)])
+
+
+def main():
+    remaining_pos_vector = load_remaining_positions(FLAGS.year)
+    print(FLAGS.test_path)
+    try:
+        extract_remaining(FLAGS.test_path, FLAGS.remaining_test_path, remaining_pos_vector)
+    except Exception as e:
+        print(e)
+
+
+def main_all(years, da_types):
+    for year in years:
+        remaining_pos_vector = load_remaining_positions(year)
+        for da_type in da_types:
+            set_year_and_da_type(year, da_type)
+            print(FLAGS.test_path)
+            try:
+                extract_remaining(FLAGS.test_path, FLAGS.remaining_test_path, remaining_pos_vector)
+            except Exception as e:
+                print(e)
+
+
+if __name__ == '__main__':
+    # --year / --da_type restrict the extraction to one year / DA type
+    years = [FLAGS.year] if FLAGS['year'].present else [int(year) for year in FLAGS.sweep_years.split(',')]
+    da_types = [FLAGS.da_type] if FLAGS['da_type'].present else FLAGS.sweep_da_types.split(',')
+    main_all(years, da_types)
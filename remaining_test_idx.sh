@@ -12,13 +12,7 @@ ASPECT_RANDOM=("BERT-aspect" "CBERT-aspect" "BERT_prepend-aspect" "BERT_expand-a
 all_da_types=("${BERT_da_types[@]}" "${CBERT_da_types[@]}" "${BERTexpand_da_types[@]}")
 
 base_command="python remaining_idx.py"
-# Loop through each year and each DA type to run the command
-for year in "${years[@]}"
-do
-  for da_type in "${ASPECT_RANDOM[@]}"
-  do
-    command="$base_command --year $year --da_type $da_type"
-    echo "Running command: $command"
-    $command
-  done
-done
\ No newline at end of file
+# One invocation extracts the remaining test data of all years and DA types
+command="$base_command --sweep_years $(IFS=,; echo "${years[*]}") --sweep_da_types $(IFS=,; echo "${ASPECT_RANDOM[*]}")"
+echo "Running command: $command"
+$command
@@ -0,0 +1,124 @@
+'''
+Runs the data preparation stages for every (year, DA type) combination in one Python process (or a small pool of
+processes), instead of starting python again for every combination as aug.sh, BERT_embedding.sh, prepare_bert.sh and
+remaining_test_idx.sh do. Loaded models stay in memory between combinations.
+The SemEval XML files of all years are converted to raw text once, in --raw_workers processes, before the augment
+stage of the first combination.
+
+Example: python sweep.py --sweep_years 2015,2016 --sweep_da_types BERT-nouns,CBERT-nouns --sweep_workers 2
+'''
+from config import *
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+
+def run_augment():
+    # what aug.sh does through main.py with loadData = True
+    from loadData import loadDataAndEmbeddings, da_options
+    loadDataAndEmbeddings(FLAGS, True, *da_options(FLAGS.da_type))
+
+
+def run_bert_embedding():
+    import TorchBert
+    TorchBert.main()
+
+
+def run_prepare_bert():
+    import prepare_bert
+    prepare_bert.main()
+
+
+def run_remaining_idx():
+    import remaining_idx
+    remaining_idx.main()
+
+
+# stages in dependency order
+STAGES = [('augment', run_augment),
+          ('bert_embedding', run_bert_embedding),
+          ('prepare_bert', run_prepare_bert),
+          ('remaining_idx', run_remaining_idx)]
+
+
+def split_flag(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def selected_stages():
+    names = split_flag(FLAGS.sweep_stages)
+    unknown = set(names) - set(name for name, _ in STAGES)
+    if unknown:
+        raise ValueError('Unknown sweep stages: ' + ', '.join(sorted(unknown)))
+    return [(name, stage) for name, stage in STAGES if name in names]
+
+
+def run_combination(combination):
+    """
+    Runs the selected stages for one (year, DA type). A failing stage skips the remaining stages of the combination.
+    :return: list of (stage, seconds, error)
+    """
+    year, da_type = combination
+    set_year_and_da_type(year, da_type)
+    timings = []
+    for name, stage in selected_stages():
+        print(f'Running {name} for {year} {da_type}')
+        start = time.perf_counter()
+        try:
+            stage()
+        except Exception:
+            traceback.print_exc()
+            timings.append((name, time.perf_counter() - start, True))
+            break
+        timings.append((name, time.perf_counter() - start, False))
+    return timings
+
+
+def print_timings(combinations, results):
+    stages = [name for name, _ in selected_stages()]
+    width = max([len('%s %s' % c) for c in combinations] + [len('total')])
+    print('\n' + ' '.join(['combination'.ljust(width)] + [name.rjust(15) for name in stages] + ['total'.rjust(15)]))
+    totals = dict.fromkeys(stages, 0.0)
+    for combination, timings in zip(combinations, results):
+        cells = dict((name, '%.1fs%s' % (seconds, ' FAILED' if failed else '')) for name, seconds, failed in timings)
+        for name, seconds, _ in timings:
+            totals[name] += seconds
+        row_total = sum(seconds for _, seconds, _ in timings)
+        print(' '.join([('%s %s' % combination).ljust(width)] + [cells.get(name, '-').rjust(15) for name in stages]
+                       + [('%.1fs' % row_total).rjust(15)]))
+    print(' '.join(['total'.ljust(width)] + [('%.1fs' % totals[name]).rjust(15) for name in stages]
+                   + [('%.1fs' % sum(totals.values())).rjust(15)]))
+
+
+def convert_xml_files(years):
+    # tokenise the XML files of all years once, the augment stage of every DA type then copies the raw files
+    from loadData import convert_xml_files
+    xml_files = []
+    for year in years:
+        set_year_and_da_type(year, FLAGS.da_type)
+        xml_files.extend([FLAGS.train_data, FLAGS.test_data])
+    start = time.perf_counter()
+    convert_xml_files(xml_files, FLAGS.semeval_raw_dir, FLAGS.raw_workers)
+    print('Converted the XML files in %.1fs' % (time.perf_counter() - start))
+
+
+def main():
+    combinations = [(int(year), da_type) for year in split_flag(FLAGS.sweep_years)
+                    for da_type in split_flag(FLAGS.sweep_da_types)]
+    stages = [name for name, _ in selected_stages()] # fail early on unknown stages
+    if 'augment' in stages and FLAGS.do_create_raw_files:
+        convert_xml_files(list(dict.fromkeys(year for year, _ in combinations)))
+    if FLAGS.sweep_workers > 1:
+        with ProcessPoolExecutor(FLAGS.sweep_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(run_combination, combinations))
+    else:
+        results = [run_combination(combination) for combination in combinations]
+    print_timings(combinations, results)
+    failed = [combination for combination, timings in zip(combinations, results) if any(f for _, _, f in timings)]
+    if failed:
+        raise Exception('Stages failed for: ' + ', '.join('%s %s' % c for c in failed))
+
+
+if __name__ == '__main__':
+    main()
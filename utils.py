@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import hashlib
+import itertools
+import os
 import numpy as np
 
 def batch_index(length, batch_size, n_iter=100, is_shuffle=True):
@@ -11,6 +14,18 @@ def batch_index(length, batch_size, n_iter=100, is_shuffle=True):
         for i in range(int(length / batch_size) + (1 if length % batch_size else 0)):
             yield index[i * batch_size:(i + 1) * batch_size]
 
+def write_selected_lines(in_file, out_file, line_numbers):
+    """
+    Copies the lines of in_file whose (0 based) number is in line_numbers to out_file, streaming in one pass.
+    :param line_numbers: set of line numbers (any other container is turned into a set)
+    """
+    if not isinstance(line_numbers, (set, frozenset)):
+        line_numbers = set(np.asarray(line_numbers, dtype=np.int64).ravel().tolist())
+    with open(in_file, 'r') as fin, open(out_file, 'w') as fout:
+        for i, line in enumerate(fin):
+            if i in line_numbers:
+                fout.write(line)
+
 def load_word_id_mapping(word_id_file, encoding='utf8'):
     """
     :param word_id_file: word-id mapping file path
@@ -60,6 +75,127 @@ def load_w2v(w2v_file, embedding_dim, is_skip=True):
     return word_dict, w2v
 
 
+def w2v_binary_paths(w2v_file):
+    """
+    :param w2v_file: text embedding file path
+    :return: paths of the binary matrix (.npy) and vocabulary index (.vocab) next to it
+    """
+    base = os.path.splitext(w2v_file)[0]
+    return base + '.npy', base + '.vocab'
+
+
+def convert_w2v_to_binary(w2v_file, embedding_dim, is_skip=True):
+    """
+    One-time conversion of a text embedding file into a float32 matrix and a vocabulary index,
+    holding exactly the rows and ids load_w2v would return for the text file.
+    :return: paths of the written matrix and vocabulary files
+    """
+    matrix_path, vocab_path = w2v_binary_paths(w2v_file)
+    word_dict, w2v = load_w2v(w2v_file, embedding_dim, is_skip)
+    # write to temporary files first, so concurrent runs never memory-map a half written matrix
+    with open(matrix_path + '.tmp', 'wb') as fp:
+        np.save(fp, w2v)
+    with open(vocab_path + '.tmp', 'w', encoding='utf-8') as fp:
+        for word, idx in word_dict.items():
+            fp.write('{} {}\n'.format(word, idx))
+    os.replace(matrix_path + '.tmp', matrix_path)
+    os.replace(vocab_path + '.tmp', vocab_path)
+    print('converted {} to {} and {}'.format(w2v_file, matrix_path, vocab_path))
+    return matrix_path, vocab_path
+
+
+def load_w2v_binary(w2v_file, embedding_dim, is_skip=True):
+    """
+    Same result as load_w2v, but reads the binary format written by convert_w2v_to_binary. The matrix is
+    memory-mapped read-only, so concurrent runs share the page cache. The conversion is done on first use
+    and redone whenever the text file is newer than its binary copy.
+    """
+    matrix_path, vocab_path = w2v_binary_paths(w2v_file)
+    stale = not (os.path.isfile(matrix_path) and os.path.isfile(vocab_path))
+    if not stale and os.path.isfile(w2v_file):
+        stale = os.path.getmtime(w2v_file) > min(os.path.getmtime(matrix_path), os.path.getmtime(vocab_path))
+    if stale:
+        convert_w2v_to_binary(w2v_file, embedding_dim, is_skip)
+    w2v = np.load(matrix_path, mmap_mode='r')
+    if w2v.dtype != np.float32 or w2v.ndim != 2 or w2v.shape[1] != embedding_dim:
+        raise ValueError('Binary embedding file {} does not hold a float32 matrix of dimension {}. Delete file and run '
+                         'again.'.format(matrix_path, embedding_dim))
+    word_dict = dict()
+    with open(vocab_path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            word, idx = line.rsplit(' ', 1)
+            word_dict[word] = int(idx)
+    print(np.shape(w2v))
+    print(word_dict['$t$'], len(w2v))
+    return word_dict, w2v
+
+
+class W2vTextWriter(object):
+    """
+    Writes token vectors in the text format read by load_w2v, formatting a whole block of vectors at once.
+    Every component is written with 9 significant digits, so it is read back as exactly the same float32.
+    """
+    def __init__(self, w2v_file, embedding_dim):
+        self.fp = open(w2v_file, 'w', encoding='utf-8')
+        self.row_fmt = '%s ' + ' '.join(['%.9g'] * embedding_dim)
+        self.firstline = True
+
+    def write(self, words, vectors):
+        if not len(words):
+            return
+        rows = np.asarray(vectors, dtype=np.float32).tolist()
+        block = '\n'.join(self.row_fmt % (word, *row) for word, row in zip(words, rows))
+        # the file has no trailing newline, every line but the first starts with one
+        self.fp.write(block if self.firstline else '\n' + block)
+        self.firstline = False
+
+    def close(self):
+        self.fp.close()
+
+
+class W2vBinaryWriter(object):
+    """
+    Writes token vectors straight into the binary format read by load_w2v_binary, without a text file in between.
+    The rows and ids are the ones load_w2v would make of the same vectors written as text (including skipping the
+    first line when is_skip is set).
+    """
+    def __init__(self, w2v_file, embedding_dim, is_skip=True):
+        self.matrix_path, self.vocab_path = w2v_binary_paths(w2v_file)
+        self.embedding_dim = embedding_dim
+        self.is_skip = is_skip
+        self.cnt = 0
+        self.raw = open(self.matrix_path + '.raw', 'wb')
+        self.vocab = open(self.vocab_path + '.tmp', 'w', encoding='utf-8')
+
+    def write(self, words, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.is_skip and len(words):
+            words, vectors = words[1:], vectors[1:]
+            self.is_skip = False
+        for word in words:
+            self.cnt += 1
+            self.vocab.write('{} {}\n'.format(word, self.cnt))
+        vectors.tofile(self.raw)
+
+    def close(self):
+        self.raw.close()
+        self.vocab.write('{} {}\n'.format('$t$', self.cnt + 1))
+        self.vocab.close()
+        raw = np.memmap(self.matrix_path + '.raw', dtype=np.float32, mode='r', shape=(self.cnt, self.embedding_dim))
+        w2v = np.lib.format.open_memmap(self.matrix_path + '.tmp', mode='w+', dtype=np.float32,
+                                        shape=(self.cnt + 2, self.embedding_dim))
+        # [0,0,...,0] represent absent words, the last row is the average vector
+        w2v[0] = 0.
+        w2v[1:self.cnt + 1] = raw
+        w2v[self.cnt + 1] = np.sum(w2v[:self.cnt + 1], axis=0) / self.cnt
+        w2v.flush()
+        del w2v, raw
+        os.remove(self.matrix_path + '.raw')
+        os.replace(self.matrix_path + '.tmp', self.matrix_path)
+        os.replace(self.vocab_path + '.tmp', self.vocab_path)
+        print('wrote {} vectors to {} and {}'.format(self.cnt, self.matrix_path, self.vocab_path))
+
+
 def load_word_embedding(word_id_file, w2v_file, embedding_dim, is_skip=False):
     word_to_id = load_word_id_mapping(word_id_file)
     word_dict, w2v = load_w2v(w2v_file, embedding_dim, is_skip)
@@ -109,6 +245,36 @@ def change_y_to_onehot(y):
     return np.asarray(onehot, dtype=np.int32)
 
 
+def parse_twitter_lines(lines, word_to_id):
+    """
+    Per instance of lines in the (sentence with $T$, target, polarity) format: the word ids left and right of the
+    target, the word ids of the target, the polarity label and the lower cased words of the sentence and target.
+    """
+    for i in range(0, len(lines), 3):
+        # targets
+        target = lines[i + 1].lower().split()
+        target_word = [word_to_id[w] for w in target if w in word_to_id]
+
+        # sentiment
+        label = lines[i + 2].strip().split()[0]
+
+        # left and right context
+        sent = lines[i].lower().split()
+        words_l, words_r = [], []
+        flag = True
+        for word in sent:
+            if word == '$t$':
+                flag = False
+                continue
+            if flag:
+                if word in word_to_id:
+                    words_l.append(word_to_id[word])
+            else:
+                if word in word_to_id:
+                    words_r.append(word_to_id[word])
+        yield words_l, words_r, target_word, label, sent, target
+
+
 def load_inputs_twitter(input_file, word_id_file, sentence_len, type_='', is_r=True, target_len=10, encoding='utf8'):
     if type(word_id_file) is str:
         word_to_id = load_word_id_mapping(word_id_file)
@@ -123,37 +289,19 @@ def load_inputs_twitter(input_file, word_id_file, sentence_len, type_='', is_r=T
     all_target, all_sent, all_y = [], [], []
     # read in txt file
     lines = open(input_file).readlines()
-    for i in range(0, len(lines), 3):
-        # targets
-        words = lines[i + 1].lower().split()
-        target = words
-
-        target_word = []
-        for w in words:
-            if w in word_to_id:
-                target_word.append(word_to_id[w])
+    if type_ == 'TC':
+        x, sen_len, x_r, sen_len_r, target_words, tar_len, all_y = encode_inputs_tc(lines, word_to_id, sentence_len, is_r,
+                                                                                    target_len)
+        all_sent = [line.lower().split() for line in lines[0::3]]
+        all_target = [line.lower().split() for line in lines[1::3]]
+        return x, sen_len, x_r, sen_len_r, change_y_to_onehot(all_y), target_words, tar_len, \
+               np.asarray(all_sent, dtype=object), np.asarray(all_target, dtype=object), np.asarray(all_y)
+    for words_l, words_r, target_word, label, sent, target in parse_twitter_lines(lines, word_to_id):
         l = min(len(target_word), target_len)
         tar_len.append(l)
         target_words.append(target_word[:l] + [0] * (target_len - l))
+        y.append(label)
 
-        # sentiment
-        y.append(lines[i + 2].strip().split()[0])
-
-        # left and right context
-        words = lines[i].lower().split()
-        sent = words
-        words_l, words_r = [], []
-        flag = True
-        for word in words:
-            if word == '$t$':
-                flag = False
-                continue
-            if flag:
-                if word in word_to_id:
-                    words_l.append(word_to_id[word])
-            else:
-                if word in word_to_id:
-                    words_r.append(word_to_id[word])
         if type_ == 'TD' or type_ == 'TC':
             # words_l.extend(target_word)
             words_l = words_l[:sentence_len]
@@ -180,7 +328,7 @@ def load_inputs_twitter(input_file, word_id_file, sentence_len, type_='', is_r=T
                np.asarray(sen_len_r), np.asarray(y)
     elif type_ == 'TC':
         return np.asarray(x), np.asarray(sen_len), np.asarray(x_r), np.asarray(sen_len_r), \
-               np.asarray(y), np.asarray(target_words), np.asarray(tar_len), np.asarray(all_sent), np.asarray(all_target), np.asarray(all_y)
+               np.asarray(y), np.asarray(target_words), np.asarray(tar_len), np.asarray(all_sent, dtype=object), np.asarray(all_target, dtype=object), np.asarray(all_y)
     elif type_ == 'IAN':
         return np.asarray(x), np.asarray(sen_len), np.asarray(target_words), \
                np.asarray(tar_len), np.asarray(y)
@@ -188,6 +336,122 @@ def load_inputs_twitter(input_file, word_id_file, sentence_len, type_='', is_r=T
         return np.asarray(x), np.asarray(sen_len), np.asarray(y)
 
 
+TARGET_MARKER = -2  # id of $t$ in corpus_ids, words not in the vocabulary get -1
+
+
+def corpus_ids(texts, word_to_id, mark_target=True):
+    """
+    Ids of the lower cased words of all texts as one flat array (-1 for words not in word_to_id), and the index of the
+    text of every word.
+    :param mark_target: whether $t$ gets TARGET_MARKER instead of its id, for sentences (targets keep the id of $t$)
+    """
+    words = [text.lower().split() for text in texts]
+    lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    lookup = dict(word_to_id)
+    if mark_target:
+        lookup['$t$'] = TARGET_MARKER
+    ids = np.fromiter((lookup.get(w, -1) for w in itertools.chain.from_iterable(words)), dtype=np.int64,
+                      count=int(lengths.sum()))
+    return ids, np.repeat(np.arange(len(words)), lengths)
+
+
+def pad_groups(ids, groups, selected, n_groups, width, reverse=False):
+    """
+    Per group, the first width of its selected ids in order (reversed if reverse) padded with 0 to width, and the number
+    of ids in every row. groups must be sorted.
+    """
+    groups = groups[selected]
+    ids = ids[selected]
+    counts = np.bincount(groups, minlength=n_groups)
+    ranks = np.arange(len(ids)) - (np.cumsum(counts) - counts)[groups]
+    lengths = np.minimum(counts, width)
+    keep = ranks < width
+    groups, ranks, ids = groups[keep], ranks[keep], ids[keep]
+    if reverse:
+        ranks = lengths[groups] - 1 - ranks
+    matrix = np.zeros((n_groups, width), dtype=np.int32)
+    matrix[groups, ranks] = ids
+    return matrix, lengths.astype(np.int32)
+
+
+def encode_inputs_tc(lines, word_to_id, sentence_len, is_r=True, target_len=10):
+    """
+    int32 x, sen_len, x_bw, sen_len_bw, target_words and tar_len of load_inputs_twitter(..., 'TC', ...) for lines, and
+    the polarity labels. The words of all sentences are looked up once and the matrices are filled with numpy.
+    """
+    n = len(lines) // 3
+    ids, sentence = corpus_ids(lines[0:3 * n:3], word_to_id)
+    # number of $t$ up to and including every word, within its sentence
+    markers_before = np.concatenate(([0], np.cumsum(ids == TARGET_MARKER)))
+    counts = np.bincount(sentence, minlength=n)
+    seen = markers_before[1:] - markers_before[np.cumsum(counts) - counts][sentence]
+    known = ids >= 0
+    x, sen_len = pad_groups(ids, sentence, known & (seen == 0), n, sentence_len)
+    x_bw, sen_len_bw = pad_groups(ids, sentence, known & (seen > 0), n, sentence_len, reverse=is_r)
+
+    target_ids, target = corpus_ids(lines[1:3 * n:3], word_to_id, mark_target=False)
+    target_words, tar_len = pad_groups(target_ids, target, target_ids >= 0, n, target_len)
+    labels = [line.strip().split()[0] for line in lines[2:3 * n:3]]
+    return x, sen_len, x_bw, sen_len_bw, target_words, tar_len, labels
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def mapping_hash(word_to_id):
+    sha = hashlib.sha1()
+    for word, idx in sorted(word_to_id.items()):
+        sha.update(('%s %d\n' % (word, idx)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+TC_TENSORS = ['x', 'sen_len', 'x_bw', 'sen_len_bw', 'target_words', 'tar_len']
+# part of the compiled file keys, raised whenever encode_inputs_tc changes its output
+TC_ENCODING_VERSION = 2
+
+
+def load_inputs_twitter_cached(input_file, word_id_file, sentence_len, is_r=True, target_len=10, cache_dir=None):
+    """
+    x, sen_len, x_bw, sen_len_bw, y, target_words and tar_len of load_inputs_twitter(..., 'TC', ...), without the
+    sentences and targets. They are compiled once into an .npz file in cache_dir, keyed by the hash of input_file, the
+    hash of the vocabulary, sentence_len, target_len, is_r and TC_ENCODING_VERSION; later calls only load that file.
+    :param cache_dir: directory of the compiled files, None or empty to always encode input_file
+    """
+    if type(word_id_file) is str:
+        word_to_id = load_word_id_mapping(word_id_file)
+    else:
+        word_to_id = word_id_file
+    cache_file = None
+    if cache_dir:
+        key = hashlib.sha1(' '.join([file_hash(input_file), mapping_hash(word_to_id), str(sentence_len), str(target_len),
+                                     str(bool(is_r)), str(TC_ENCODING_VERSION)]).encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_dir, os.path.basename(input_file) + '.' + key[:16] + '.npz')
+
+    if cache_file and os.path.isfile(cache_file):
+        with np.load(cache_file) as data:
+            x, sen_len, x_bw, sen_len_bw, target_words, tar_len = [data[name] for name in TC_TENSORS]
+            labels = data['labels'].tolist()
+        print('loaded compiled inputs ' + cache_file)
+    else:
+        with open(input_file) as f:
+            lines = f.readlines()
+        x, sen_len, x_bw, sen_len_bw, target_words, tar_len, labels = encode_inputs_tc(lines, word_to_id, sentence_len,
+                                                                                       is_r, target_len)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file + '.tmp', 'wb') as f:
+                np.savez(f, x=x, sen_len=sen_len, x_bw=x_bw, sen_len_bw=sen_len_bw, target_words=target_words,
+                         tar_len=tar_len, labels=np.array(labels, dtype=str))
+            os.replace(cache_file + '.tmp', cache_file)
+    # the one-hot columns follow change_y_to_onehot of this process, as with load_inputs_twitter
+    return x, sen_len, x_bw, sen_len_bw, change_y_to_onehot(labels), target_words, tar_len
+
+
 def load_inputs_twitter_(input_file, word_id_file, sentence_len, type_='', is_r=True, target_len=10, encoding='utf8'):
     if type(word_id_file) is str:
         word_to_id = load_word_id_mapping(word_id_file)